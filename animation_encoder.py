@@ -0,0 +1,408 @@
+"""
+动画海报编码模块
+帧由生成器按顺序提供，编码器每次只取一帧，内存占用不随帧数增长
+"""
+
+import io
+import os
+import struct
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from fractions import Fraction
+from functools import partial
+from itertools import chain
+
+from PIL import GifImagePlugin, Image, ImageChops, PngImagePlugin
+from logger import get_module_logger
+
+# 获取模块日志记录器
+logger = get_module_logger("animation_encoder")
+
+# PNG文件签名
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+class FrameStream:
+    """
+    把帧生成器包装成多帧图片，供 Pillow 的多帧编码器通过 append_images 使用
+
+    编码器按顺序 seek 到下一帧时才从生成器取帧，已编码的帧随即释放。
+    其余属性都转发给当前帧
+    """
+
+    def __init__(self, frames, n_frames):
+        self._frames = iter(frames)
+        self._frame = None
+        self._index = -1
+        self.n_frames = n_frames
+        self.is_animated = n_frames > 1
+        self.seek(0)
+
+    def seek(self, index):
+        if index == self._index:
+            return
+        if index != self._index + 1:
+            raise EOFError("帧只能按顺序读取")
+        try:
+            self._frame = next(self._frames)
+        except StopIteration:
+            raise EOFError("帧数量少于声明的数量") from None
+        self._index = index
+
+    def tell(self):
+        return self._index
+
+    def __getattr__(self, name):
+        return getattr(self._frame, name)
+
+
+def save_webp(
+    frames,
+    output,
+    frame_count,
+    duration,
+    quality=85,
+    method=4,
+    lossless=False,
+    minimize_size=False,
+    kmin=None,
+    kmax=None,
+):
+    """
+    逐帧编码动态WebP
+
+    参数:
+        frames: 按顺序产生RGBA帧的可迭代对象
+        output: 输出文件路径或可写的文件对象
+        frame_count: 总帧数
+        duration: 每帧持续时间（毫秒）
+        quality: 压缩质量，无损模式下表示压缩力度
+        method: 压缩方法（0-6，越高越慢但压缩越好）
+        lossless: 是否使用无损压缩
+        minimize_size: 是否以最小体积为目标编码（更慢，并且不再插入关键帧）
+        kmin: 关键帧最小间隔，为 None 时使用编码器默认值
+        kmax: 关键帧最大间隔，为 None 时使用编码器默认值
+    """
+    # 转换为RGBX格式，移除alpha通道
+    webp_frames = (frame.convert("RGBX") for frame in frames)
+    first_frame = next(webp_frames)
+    append_images = [FrameStream(webp_frames, frame_count - 1)] if frame_count > 1 else []
+
+    first_frame.save(
+        output,
+        format="WEBP",
+        save_all=True,
+        append_images=append_images,
+        duration=duration,
+        loop=0,
+        quality=quality,
+        method=method,
+        lossless=lossless,
+        minimize_size=minimize_size,
+        kmin=kmin,
+        kmax=kmax,
+    )
+
+
+def save_avif(frames, output, frame_count, duration, quality=85, speed=8):
+    """
+    逐帧编码动态AVIF，每帧加入编码器时即被压缩
+
+    参数:
+        frames: 按顺序产生RGBA帧的可迭代对象
+        output: 输出文件路径或可写的文件对象
+        frame_count: 总帧数
+        duration: 每帧持续时间（毫秒）
+        quality: 压缩质量（0-100）
+        speed: 编码速度（0-10，越低越慢但压缩越好）
+    """
+    # 海报背景不透明，去掉alpha通道
+    avif_frames = (frame.convert("RGB") for frame in frames)
+    first_frame = next(avif_frames)
+    append_images = [FrameStream(avif_frames, frame_count - 1)] if frame_count > 1 else []
+
+    first_frame.save(
+        output,
+        format="AVIF",
+        save_all=True,
+        append_images=append_images,
+        duration=duration,
+        quality=quality,
+        speed=speed,
+    )
+
+
+def build_gif_palette(samples, colors):
+    """
+    用多帧采样生成GIF调色板
+
+    各帧缩小后拼成一张图再量化，后面帧才出现的颜色也能分到调色板位置
+
+    参数:
+        samples: 采样帧列表
+        colors: 调色板颜色数
+
+    返回:
+        P模式的调色板图片，可用于 quantize(palette=...)
+    """
+    scaled = []
+    for sample in samples:
+        sample = sample.convert("RGB")
+        # 大尺寸帧缩小后采样，颜色分布基本不变
+        factor = max(1, sample.width // 640)
+        scaled.append(sample.reduce(factor) if factor > 1 else sample)
+
+    montage = Image.new(
+        "RGB", (max(image.width for image in scaled), sum(image.height for image in scaled))
+    )
+    y = 0
+    for image in scaled:
+        montage.paste(image, (0, y))
+        y += image.height
+
+    return montage.quantize(colors=colors, method=Image.Quantize.MEDIANCUT)
+
+
+def _changed_mask(frame_rgb, previous_rgb):
+    """返回两帧之间有变化的像素遮罩，任一通道不同即视为变化"""
+    diff = ImageChops.difference(frame_rgb, previous_rgb)
+    r, g, b = diff.split()
+    return ImageChops.lighter(ImageChops.lighter(r, g), b).point(lambda v: 255 if v else 0)
+
+
+def _encode_gif_frame(frame, previous, palette_image, transparent_index):
+    """
+    量化一帧，只保留与上一帧相比有变化的区域
+
+    参数:
+        frame: 当前帧
+        previous: 上一帧，第一帧为 None
+        palette_image: 调色板图片
+        transparent_index: 透明色索引，为 None 时不使用透明色
+
+    返回:
+        (裁剪后的P模式帧, 偏移)，与上一帧完全相同时返回 None
+    """
+    frame_rgb = frame.convert("RGB")
+    # 使用全局调色板进行量化，抖动减少色带
+    frame_p = frame_rgb.quantize(palette=palette_image, dither=Image.Dither.FLOYDSTEINBERG)
+    if previous is None:
+        return frame_p, (0, 0)
+
+    # 按原始像素判断变化，抖动带来的差异不会让静止区域（如文字）闪烁
+    changed = _changed_mask(frame_rgb, previous.convert("RGB"))
+    bbox = changed.getbbox()
+    if bbox is None:
+        return None
+
+    # 没有变化的像素设为透明，显示上一帧保留下来的内容
+    if transparent_index is not None:
+        frame_p.paste(transparent_index, mask=ImageChops.invert(changed))
+    return frame_p.crop(bbox), bbox[:2]
+
+
+def _with_previous(frames):
+    """产生 (当前帧, 上一帧)，第一帧的上一帧为 None"""
+    previous = None
+    for frame in frames:
+        yield frame, previous
+        previous = frame
+
+
+def _map_in_order(executor, func, items, window):
+    """
+    在线程池中处理各帧，按提交顺序产生结果
+
+    最多 window 个任务同时在处理或等待取走，只有少量帧同时在内存中
+    """
+    items = iter(items)
+    in_flight = deque()
+    while True:
+        while len(in_flight) < window:
+            args = next(items, None)
+            if args is None:
+                break
+            in_flight.append(executor.submit(func, *args))
+        if not in_flight:
+            return
+        yield in_flight.popleft().result()
+
+
+def _merge_unchanged(results, duration):
+    """
+    把与上一帧完全相同的帧（结果为 None）合并到上一帧的持续时间
+
+    上一帧要等下一帧处理完才能确定持续时间，产生 (结果, 持续时间)
+    """
+    pending = None
+    for result in results:
+        if result is None:
+            pending[1] += duration
+            continue
+        if pending is not None:
+            yield tuple(pending)
+        pending = [result, duration]
+    if pending is not None:
+        yield tuple(pending)
+
+
+def save_gif(frames, output, duration, colors=256, palette_samples=None, optimize=True, workers=1):
+    """
+    逐帧编码GIF
+
+    Pillow 的 GIF 编码器会先收集全部帧，这里直接写文件头和逐帧数据。
+    各帧的量化和变化区域计算在线程池中进行，按顺序写入
+
+    参数:
+        frames: 按顺序产生RGBA帧的可迭代对象
+        output: 输出文件路径或可写的文件对象
+        duration: 每帧持续时间（毫秒）
+        colors: 调色板颜色数
+        palette_samples: 用于生成调色板的采样帧，为 None 时使用第一帧
+        optimize: 是否把没有变化的像素设为透明，只写入变化的区域
+        workers: 量化线程数
+    """
+    frames = iter(frames)
+    first_frame = next(frames)
+    colors = max(2, min(256, colors))
+
+    # 所有帧共享同一调色板以避免文字闪烁；需要透明色时留出一个位置
+    palette_image = build_gif_palette(
+        palette_samples or [first_frame], colors - 1 if optimize else colors
+    )
+    palette = palette_image.getpalette()
+    transparent_index = len(palette) // 3 if optimize else None
+
+    # 用与帧尺寸相同的空白图片生成文件头，调色板末尾补上透明色的位置
+    header_image = Image.new("P", first_frame.size)
+    header_image.putpalette(palette + [0, 0, 0] if optimize else palette)
+    header, _ = GifImagePlugin.getheader(
+        header_image, info={"loop": 0, "duration": duration}
+    )
+
+    is_path = isinstance(output, (str, os.PathLike))
+    with open(output, "wb") if is_path else nullcontext(output) as fp, ThreadPoolExecutor(
+        max_workers=max(1, workers)
+    ) as executor:
+        for block in header:
+            fp.write(block)
+
+        encode = partial(
+            _encode_gif_frame, palette_image=palette_image, transparent_index=transparent_index
+        )
+        results = _map_in_order(
+            executor, encode, _with_previous(chain([first_frame], frames)), max(1, workers) * 2
+        )
+        for index, ((frame, offset), frame_duration) in enumerate(_merge_unchanged(results, duration)):
+            params = {"duration": frame_duration}
+            if transparent_index is not None and index > 0:
+                # 保留上一帧的内容，透明像素显示上一帧
+                params.update(disposal=1, transparency=transparent_index)
+            for block in GifImagePlugin.getdata(frame, offset, **params):
+                fp.write(block)
+
+        fp.write(b";")  # 文件结束
+
+
+def _png_image_data(png_bytes):
+    """从完整的PNG文件中取出压缩后的图像数据（所有IDAT块的内容）"""
+    data = []
+    position = len(PNG_SIGNATURE)
+    while position < len(png_bytes):
+        length, chunk_type = struct.unpack(">I4s", png_bytes[position:position + 8])
+        if chunk_type == b"IDAT":
+            data.append(png_bytes[position + 8:position + 8 + length])
+        position += length + 12
+    return b"".join(data)
+
+
+def _encode_png_frame(frame, previous, compress_level):
+    """
+    压缩一帧中与上一帧相比有变化的矩形区域
+
+    返回:
+        (压缩后的图像数据, 区域)，与上一帧完全相同时返回 None
+    """
+    frame = frame.convert("RGB")
+    if previous is None:
+        bbox = (0, 0) + frame.size
+    else:
+        bbox = ImageChops.difference(frame, previous.convert("RGB")).getbbox()
+        if bbox is None:
+            return None
+
+    # 借用 Pillow 的PNG编码器完成逐行滤波和压缩
+    buffer = io.BytesIO()
+    frame.crop(bbox).save(buffer, format="PNG", compress_level=compress_level)
+    return _png_image_data(buffer.getvalue()), bbox
+
+
+def save_apng(frames, output, duration, compress_level=6, workers=1):
+    """
+    逐帧编码APNG
+
+    Pillow 的 APNG 编码器会先收集全部帧，这里直接写各个数据块，
+    每帧只写入与上一帧相比有变化的矩形区域。输出必须支持 seek，
+    帧数在合并相同帧之后才能确定，最后回写到 acTL 块
+
+    参数:
+        frames: 按顺序产生RGBA帧的可迭代对象
+        output: 输出文件路径或可写的文件对象
+        duration: 每帧持续时间（毫秒）
+        compress_level: zlib压缩级别（0-9）
+        workers: 压缩线程数
+    """
+    frames = iter(frames)
+    first_frame = next(frames)
+    width, height = first_frame.size
+
+    is_path = isinstance(output, (str, os.PathLike))
+    with open(output, "wb") if is_path else nullcontext(output) as fp, ThreadPoolExecutor(
+        max_workers=max(1, workers)
+    ) as executor:
+        fp.write(PNG_SIGNATURE)
+        # 8位RGB，不隔行
+        PngImagePlugin.putchunk(fp, b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        actl_position = fp.tell()
+        PngImagePlugin.putchunk(fp, b"acTL", struct.pack(">II", 0, 0))
+
+        encode = partial(_encode_png_frame, compress_level=compress_level)
+        results = _map_in_order(
+            executor, encode, _with_previous(chain([first_frame], frames)), max(1, workers) * 2
+        )
+        sequence = 0
+        frame_total = 0
+        for (data, bbox), frame_duration in _merge_unchanged(results, duration):
+            delay = Fraction(frame_duration, 1000).limit_denominator(65535)
+            # 变化区域直接覆盖上一帧的内容（dispose_op=NONE, blend_op=SOURCE）
+            PngImagePlugin.putchunk(
+                fp,
+                b"fcTL",
+                struct.pack(
+                    ">IIIIIHHBB",
+                    sequence,
+                    bbox[2] - bbox[0],
+                    bbox[3] - bbox[1],
+                    bbox[0],
+                    bbox[1],
+                    delay.numerator,
+                    delay.denominator,
+                    0,
+                    0,
+                ),
+            )
+            sequence += 1
+            if frame_total == 0:
+                # 第一帧写成普通图像数据，不支持APNG的程序也能显示
+                PngImagePlugin.putchunk(fp, b"IDAT", data)
+            else:
+                PngImagePlugin.putchunk(fp, b"fdAT", struct.pack(">I", sequence), data)
+                sequence += 1
+            frame_total += 1
+
+        PngImagePlugin.putchunk(fp, b"IEND", b"")
+        end_position = fp.tell()
+        fp.seek(actl_position)
+        PngImagePlugin.putchunk(fp, b"acTL", struct.pack(">II", frame_total, 0))
+        fp.seek(end_position)
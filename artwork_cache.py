@@ -0,0 +1,82 @@
+"""
+海报缓存模块
+按 (服务器, 媒体项ID, 图片标签) 在本地缓存下载过的海报，
+图片标签不变说明服务器上的图片没有变化，直接使用本地缓存，不再重复下载
+"""
+
+import hashlib
+import os
+import time
+
+import config
+from logger import get_module_logger
+
+# 获取模块日志记录器
+logger = get_module_logger("artwork_cache")
+
+ARTWORK_CACHE_FOLDER = os.path.join(config.CACHE_FOLDER, "artwork")
+
+
+def get_variant(params):
+    """将图片请求参数转换为稳定的字符串，用于区分同一图片的不同尺寸/格式"""
+    if not params:
+        return ""
+    return "&".join(f"{key}={params[key]}" for key in sorted(params))
+
+
+def get_cache_path(base_url, item_id, image_tag, variant=""):
+    """
+    根据服务器地址、媒体项ID、图片标签和请求参数计算缓存文件路径
+
+    返回:
+        缓存文件路径，没有图片标签时返回None（无法判断图片是否变化）
+    """
+    if not image_tag:
+        return None
+    key = hashlib.sha1(
+        f"{base_url.rstrip('/')}|{item_id}|{image_tag}|{variant}".encode("utf-8")
+    ).hexdigest()
+    # 按前两位分子目录，避免单个目录文件过多
+    return os.path.join(ARTWORK_CACHE_FOLDER, key[:2], f"{key}.jpg")
+
+
+def lookup(cache_path):
+    """检查缓存是否命中，命中时刷新文件时间，避免被过期清理"""
+    if cache_path and os.path.isfile(cache_path):
+        os.utime(cache_path, None)
+        return True
+    return False
+
+
+def prune_folder(folder, max_age_days):
+    """
+    删除目录中超过指定天数未使用的文件
+
+    返回:
+        int: 删除的文件数量
+    """
+    if not max_age_days or not os.path.isdir(folder):
+        return 0
+
+    expire_before = time.time() - max_age_days * 86400
+    removed = 0
+    for root, _, files in os.walk(folder):
+        for file_name in files:
+            file_path = os.path.join(root, file_name)
+            try:
+                if os.path.getmtime(file_path) < expire_before:
+                    os.remove(file_path)
+                    removed += 1
+            except OSError as e:
+                logger.warning(f"清理缓存文件失败: {file_path}, {e}")
+    return removed
+
+
+def prune_cache(max_age_days=None):
+    """删除超过指定天数未使用的缓存文件"""
+    if max_age_days is None:
+        max_age_days = config.CACHE_CONFIG["MAX_AGE_DAYS"]
+    removed = prune_folder(ARTWORK_CACHE_FOLDER, max_age_days)
+    if removed:
+        logger.info(f"已清理 {removed} 个超过 {max_age_days} 天未使用的海报缓存")
+    return removed
@@ -0,0 +1,325 @@
+"""
+异步网络客户端
+基于 aiohttp 实现认证、获取媒体库和媒体项、下载和上传海报，
+所有服务器的请求都在同一个后台线程的事件循环中执行，不需要为每个请求占用一个线程。
+每个服务器一个会话，会话的连接数上限与同步模式的连接池大小相同。
+只在配置 async_network 为 true 时导入，需要安装 aiohttp
+"""
+
+import asyncio
+import os
+import shutil
+import threading
+
+import aiohttp
+
+import artwork_cache
+import config
+from auth import build_auth_request, parse_auth_response
+from get_library import parse_libraries
+from get_poster import build_items_url, get_artwork_cache_path, get_image_request_params
+from logger import get_module_logger
+
+# 获取模块日志记录器
+logger = get_module_logger("async_client")
+
+# 服务器暂时不可用时重试的状态码，与同步会话的重试策略一致
+RETRY_STATUS = (502, 503, 504)
+
+# 执行所有网络请求的事件循环及其线程
+_loop = None
+_loop_lock = threading.Lock()
+
+# 按服务器地址缓存的客户端
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def _get_loop():
+    """获取后台事件循环，第一次使用时启动"""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=_loop.run_forever, name="async-network", daemon=True
+            ).start()
+        return _loop
+
+
+def run(coro, timeout=None):
+    """
+    在后台事件循环中执行协程，等待并返回结果
+
+    超时或等待被中断时取消协程，正在进行的请求会被中止
+
+    参数:
+        coro: 协程
+        timeout: 最长等待时间（秒），None 表示一直等待
+    """
+    future = asyncio.run_coroutine_threadsafe(coro, _get_loop())
+    try:
+        return future.result(timeout)
+    except BaseException:
+        future.cancel()
+        raise
+
+
+def _token_headers(server):
+    return {"Authorization": f'MediaBrowser Token="{server["ACCESS_TOKEN"]}"'}
+
+
+def _log_prefix(server, library_name=None):
+    log_prefix = f"[{server['SERVER_NAME']}]"
+    if library_name:
+        log_prefix += f"[{library_name}]"
+    return log_prefix
+
+
+class AsyncJellyfinClient:
+    """
+    一个Jellyfin/Emby服务器的异步客户端
+
+    认证信息来自每次调用传入的服务器上下文，同一地址的多个用户可以共用一个客户端。
+    所有方法都必须在后台事件循环中执行
+    """
+
+    def __init__(self, base_url, limit):
+        """
+        参数:
+            base_url: 服务器地址
+            limit: 同时打开的最大连接数
+        """
+        self.base_url = base_url
+        self.limit = limit
+        self._session = None
+
+    def _get_session(self):
+        """获取会话，第一次使用时在事件循环中创建"""
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.limit),
+                # 与同步模式一样，超时限制的是连接和每次读取，而不是整个下载
+                timeout=aiohttp.ClientTimeout(
+                    total=None,
+                    sock_connect=config.HTTP_CONFIG["TIMEOUT"],
+                    sock_read=config.HTTP_CONFIG["TIMEOUT"],
+                ),
+                headers={"User-Agent": config.HTTP_CONFIG["USER_AGENT"]},
+            )
+            logger.debug(f"为服务器 {self.base_url} 创建异步会话，最大连接数: {self.limit}")
+        return self._session
+
+    async def _get(self, url, headers, params=None):
+        """
+        GET请求，连接失败或服务器暂时不可用时按配置重试
+
+        返回:
+            aiohttp.ClientResponse，调用方负责释放
+        """
+        session = self._get_session()
+        retries = config.HTTP_CONFIG["RETRIES"]
+        for attempt in range(retries + 1):
+            try:
+                response = await session.get(url, headers=headers, params=params)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if attempt == retries:
+                    raise
+            else:
+                if response.status not in RETRY_STATUS or attempt == retries:
+                    return response
+                response.release()
+            await asyncio.sleep(config.HTTP_CONFIG["BACKOFF_FACTOR"] * 2 ** attempt)
+
+    async def authenticate(self, server):
+        """
+        进行身份验证，返回值与 auth.authenticate 相同
+        """
+        url, headers, payload = build_auth_request(server)
+        try:
+            logger.info(f"正在连接服务器: {server['BASE_URL']}")
+            async with self._get_session().post(url, headers=headers, data=payload) as response:
+                response.raise_for_status()  # 检查HTTP错误
+                data = await response.json(content_type=None)
+            return parse_auth_response(server, data)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error(f"认证请求失败: {str(e)}")
+            return None
+        except ValueError:
+            logger.error("无法解析服务器响应")
+            return None
+
+    async def get_libraries(self, server):
+        """
+        获取媒体库列表，返回值与 get_library.get_libraries 相同，调用前需要完成认证
+        """
+        url = f"{server['BASE_URL']}/Library/MediaFolders"
+        try:
+            async with await self._get(url, _token_headers(server)) as response:
+                response.raise_for_status()  # 检查HTTP错误
+                data = await response.json(content_type=None)
+            return parse_libraries(data)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error(f"[{server['SERVER_NAME']}] 获取媒体库列表失败: {str(e)}")
+            return []
+        except (ValueError, KeyError) as e:
+            logger.error(f"[{server['SERVER_NAME']}] 解析媒体库列表数据失败: {str(e)}")
+            return []
+
+    async def get_items(self, server, parent_id, library_name=None):
+        """
+        获取媒体项列表，返回值与 get_poster.get_items 相同
+        """
+        url = build_items_url(server, parent_id, library_name)
+        log_prefix = _log_prefix(server, library_name)
+        try:
+            logger.info(f"{log_prefix} 正在从 Jellyfin 获取媒体列表...")
+            async with await self._get(url, _token_headers(server)) as response:
+                if response.status != 200:
+                    logger.error(f"{log_prefix} 获取媒体列表失败，状态码: {response.status}")
+                    return []
+                data = await response.json(content_type=None)
+            if len(data) > 0:
+                logger.info(f"{log_prefix} 成功获取到 {len(data.get('Items', []))} 个媒体项")
+                return data.get("Items", [])
+            logger.warning(f"{log_prefix} 未找到任何媒体项")
+            return []
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            logger.error(f"{log_prefix} 获取媒体列表时出错: {e}")
+            return []
+
+    async def download_image(self, server, item_id, output_path, index, library_name=None, params=None):
+        """
+        下载媒体项的封面图片，返回值与 get_poster.download_image 相同。
+        被取消时删除写了一半的文件
+        """
+        url = f"{server['BASE_URL']}/Items/{item_id}/Images/{server['IMAGE_TYPE']}"
+        log_prefix = _log_prefix(server, library_name)
+        try:
+            async with await self._get(url, _token_headers(server), params) as response:
+                if response.status != 200:
+                    logger.warning(f"{log_prefix} 下载图片 {index} 失败，状态码: {response.status}")
+                    return False
+                with open(output_path, "wb") as f:
+                    async for chunk in response.content.iter_chunked(64 * 1024):
+                        f.write(chunk)
+            return True
+        except asyncio.CancelledError:
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            raise
+        except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+            logger.error(f"{log_prefix} 下载图片 {index} 时出错: {e}")
+            return False
+
+    async def upload_image(self, server, item_id, image_data, library_name, content_type="image/jpeg"):
+        """
+        上传图片，返回值与 update_poster.upload_image 相同。上传不重试，失败由调用方处理
+        """
+        url = f"{server['BASE_URL']}/Items/{item_id}/Images/{server['IMAGE_TYPE']}"
+        headers = dict(_token_headers(server), **{"Content-Type": content_type})
+        try:
+            async with self._get_session().post(url, headers=headers, data=image_data) as response:
+                if response.status in (200, 204):
+                    logger.info(f"[{server['SERVER_NAME']}][{library_name}] 成功: 图片上传成功")
+                    return True
+                logger.error(
+                    f"[{server['SERVER_NAME']}][{library_name}] 错误: 图片上传失败，状态码: {response.status}"
+                )
+                logger.error(
+                    f"[{server['SERVER_NAME']}][{library_name}] 错误详情: {(await response.text())[:500]}"
+                )
+                return False
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error(f"[{server['SERVER_NAME']}][{library_name}] 错误: 请求过程中出错: {e}")
+            return False
+
+    async def close(self):
+        """关闭会话，释放所有连接"""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+def get_client(server):
+    """
+    获取指定服务器的共享客户端，不存在则创建
+
+    参数:
+        server: 服务器上下文
+
+    返回:
+        AsyncJellyfinClient
+    """
+    base_url = server["BASE_URL"].rstrip("/")
+    with _clients_lock:
+        client = _clients.get(base_url)
+        if client is None:
+            # 连接数与同步模式的连接池大小相同：所有下载同时进行，再留出获取列表和上传用的连接
+            limit = max(
+                config.HTTP_CONFIG["POOL_MAXSIZE"],
+                server.get("DOWNLOAD_WORKERS", 4) + 2,
+            )
+            client = AsyncJellyfinClient(base_url, limit)
+            _clients[base_url] = client
+        return client
+
+
+async def fetch_poster(server, item, output_path, index, library_name=None):
+    """
+    获取媒体项的封面图片，缓存逻辑与 get_poster.fetch_poster 相同
+
+    返回:
+        tuple: (是否成功, 是否命中缓存)
+    """
+    client = get_client(server)
+    params = get_image_request_params()
+    cache_path = get_artwork_cache_path(server, item, params)
+    if cache_path is None:
+        return await client.download_image(
+            server, item["Id"], output_path, index, library_name, params
+        ), False
+
+    if artwork_cache.lookup(cache_path):
+        shutil.copyfile(cache_path, output_path)
+        return True, True
+
+    # 先下载到临时文件，完整下载后再放入缓存，避免中断时留下损坏的缓存
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    temp_cache_path = f"{cache_path}.{id(asyncio.current_task())}.tmp"
+    if not await client.download_image(
+        server, item["Id"], temp_cache_path, index, library_name, params
+    ):
+        if os.path.exists(temp_cache_path):
+            os.remove(temp_cache_path)
+        return False, False
+    os.replace(temp_cache_path, cache_path)
+    shutil.copyfile(cache_path, output_path)
+    return True, False
+
+
+async def fetch_posters(server, items, output_paths, library_name=None):
+    """
+    同时获取多个媒体项的封面图片，结果按输入顺序排列。
+    被取消时所有未完成的下载一起取消
+    """
+    return await asyncio.gather(
+        *(
+            fetch_poster(server, item, output_path, index, library_name)
+            for index, (item, output_path) in enumerate(zip(items, output_paths), 1)
+        )
+    )
+
+
+async def _close_clients(clients):
+    for client in clients:
+        await client.close()
+
+
+def close_all_clients():
+    """关闭所有客户端，释放空闲连接（每轮任务结束后调用）"""
+    with _clients_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    if clients:
+        run(_close_clients(clients))
@@ -1,48 +1,79 @@
 import requests
 import json
 import os
+import config
+from http_session import get_session
 from logger import get_module_logger
 
 # 获取模块日志记录器
 logger = get_module_logger("auth")
 
 
-def authenticate(base_url, username, password):
+def build_auth_request(server):
     """
-    进行Jellyfin/Emby身份验证并返回User.Id和AccessToken
+    构造认证请求
 
     Returns:
-        dict: 包含User.Id和AccessToken的字典，验证失败则返回None
+        tuple: (url, 请求头, 请求体)
     """
+    url = f"{server['BASE_URL']}/Users/AuthenticateByName"
 
-    url = f"{base_url}/Users/AuthenticateByName"
-
-    payload = json.dumps({"username": username, "Pw": password})
+    payload = json.dumps({"username": server["USER_NAME"], "Pw": server["PASSWORD"]})
 
     headers = {
         "authorization": 'MediaBrowser Client="other", Device="jellyfin-library-poster", DeviceId="123", Version="0.0.0"',
         "Content-Type": "application/json",
     }
+    return url, headers, payload
+
+
+def parse_auth_response(server, data):
+    """
+    从认证响应中提取User.Id和AccessToken
+
+    Returns:
+        dict: 认证信息，缺少必要信息时返回None
+    """
+    auth_info = {
+        "user_id": data.get("User", {}).get("Id"),
+        "access_token": data.get("AccessToken"),
+        "base_url": server["BASE_URL"],  # 同时返回base_url方便后续使用
+    }
+
+    # 验证是否成功获取了必要信息
+    if auth_info["user_id"] and auth_info["access_token"]:
+        logger.info(f"认证成功: 用户 {server['USER_NAME']}")
+        return auth_info
+    else:
+        logger.error("认证成功但未能获取User.Id或AccessToken")
+        return None
+
+
+def authenticate(server):
+    """
+    进行Jellyfin/Emby身份验证并返回User.Id和AccessToken
+
+    Args:
+        server: 服务器上下文，使用其中的BASE_URL、USER_NAME和PASSWORD
+
+    Returns:
+        dict: 包含User.Id和AccessToken的字典，验证失败则返回None
+    """
+    if config.ASYNC_NETWORK:
+        # 异步网络模式：请求在共享的事件循环中执行
+        import async_client
+        return async_client.run(async_client.get_client(server).authenticate(server))
+
+    url, headers, payload = build_auth_request(server)
 
     try:
-        logger.info(f"正在连接服务器: {base_url}")
-        response = requests.request("POST", url, headers=headers, data=payload)
+        logger.info(f"正在连接服务器: {server['BASE_URL']}")
+        response = get_session(server).post(
+            url, headers=headers, data=payload, timeout=config.HTTP_CONFIG["TIMEOUT"]
+        )
         response.raise_for_status()  # 检查HTTP错误
 
-        data = response.json()
-        auth_info = {
-            "user_id": data.get("User", {}).get("Id"),
-            "access_token": data.get("AccessToken"),
-            "base_url": base_url,  # 同时返回base_url方便后续使用
-        }
-
-        # 验证是否成功获取了必要信息
-        if auth_info["user_id"] and auth_info["access_token"]:
-            logger.info(f"认证成功: 用户 {username}")
-            return auth_info
-        else:
-            logger.error("认证成功但未能获取User.Id或AccessToken")
-            return None
+        return parse_auth_response(server, response.json())
 
     except requests.exceptions.RequestException as e:
         logger.error(f"认证请求失败: {str(e)}")
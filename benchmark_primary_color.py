@@ -0,0 +1,107 @@
+"""
+主色调提取性能对比脚本
+使用 poster 文件夹中已下载的海报，对比旧版逐像素统计和新版量化统计的耗时与结果
+
+使用示例:
+    python benchmark_primary_color.py            # 使用 poster 文件夹中的全部海报
+    python benchmark_primary_color.py 某个目录    # 使用指定目录中的海报
+"""
+
+import os
+import sys
+import time
+from collections import Counter
+from PIL import Image
+
+# 添加项目路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import config
+from gen_poster import get_poster_primary_color
+
+
+def legacy_get_poster_primary_color(image_path):
+    """旧版实现：逐像素过滤后用 Counter 统计完全相同的颜色"""
+    img = Image.open(image_path)
+    img = img.resize((100, 150), Image.LANCZOS)
+    if img.mode != 'RGBA':
+        img = img.convert('RGBA')
+
+    pixels = list(img.getdata())
+    filtered_pixels = []
+    for pixel in pixels:
+        r, g, b, a = pixel
+        if a < 200:
+            continue
+        brightness = (r + g + b) / 3
+        if brightness < 30 or brightness > 220:
+            continue
+        filtered_pixels.append((r, g, b, 255))
+
+    if not filtered_pixels:
+        filtered_pixels = [(p[0], p[1], p[2], 255) for p in pixels if p[3] > 100]
+    if not filtered_pixels:
+        return (150, 100, 50, 255)
+
+    return Counter(filtered_pixels).most_common(10)
+
+
+def find_posters(folder):
+    """查找目录下的所有海报图片"""
+    posters = []
+    for root, _, files in os.walk(folder):
+        for file in sorted(files):
+            if file.lower().endswith((".jpg", ".jpeg", ".png", ".webp")):
+                posters.append(os.path.join(root, file))
+    return posters
+
+
+def measure(func, posters, rounds):
+    """多轮执行，返回平均每张海报耗时（毫秒）和最后一轮的结果"""
+    results = []
+    start = time.perf_counter()
+    for _ in range(rounds):
+        results = [func(path) for path in posters]
+    elapsed = time.perf_counter() - start
+    return elapsed / rounds / len(posters) * 1000, results
+
+
+def describe(result):
+    """格式化第一个候选颜色及其占比"""
+    if not isinstance(result, list) or not result:
+        return f"{result}"
+    color, count = result[0]
+    return f"{color[:3]} x{count}"
+
+
+def run_benchmark(folder, rounds=3):
+    """运行对比测试"""
+    print("=" * 50)
+    print("主色调提取性能对比")
+    print("=" * 50)
+
+    posters = find_posters(folder)
+    if not posters:
+        print(f"在 {folder} 中没有找到海报图片，请先运行一次海报下载")
+        return False
+    print(f"海报数量: {len(posters)}，每种实现执行 {rounds} 轮")
+
+    legacy_ms, legacy_results = measure(legacy_get_poster_primary_color, posters, rounds)
+    new_ms, new_results = measure(get_poster_primary_color, posters, rounds)
+
+    print(f"\n旧版平均耗时: {legacy_ms:.2f} ms/张")
+    print(f"新版平均耗时: {new_ms:.2f} ms/张")
+    print(f"加速比: {legacy_ms / new_ms:.1f}x")
+
+    print("\n首选颜色对比 (旧版 -> 新版):")
+    for path, old, new in zip(posters, legacy_results, new_results):
+        name = os.path.relpath(path, folder)
+        print(f"  {name}: {describe(old)} -> {describe(new)}")
+
+    return True
+
+
+if __name__ == "__main__":
+    target = sys.argv[1] if len(sys.argv) > 1 else config.POSTER_FOLDER
+    success = run_benchmark(target)
+    sys.exit(0 if success else 1)
@@ -0,0 +1,100 @@
+"""
+海报单元格缓存模块
+缩放、圆角和阴影处理后的单元格以原始RGBA像素保存在磁盘上，
+下次使用时直接内存映射，不需要解码和重新处理。
+缓存按海报图片内容和单元格参数区分，不同服务器、静态和动态海报使用同一份缓存
+"""
+
+import hashlib
+import mmap
+import os
+import struct
+import threading
+
+import config
+from artwork_cache import prune_folder
+from logger import get_module_logger
+
+# 获取模块日志记录器
+logger = get_module_logger("cell_cache")
+
+CELL_CACHE_FOLDER = os.path.join(config.CACHE_FOLDER, "cells")
+
+# 单元格处理效果有变化时递增，使旧版本生成的缓存失效
+CELL_VERSION = 1
+
+# 文件头：宽度和高度，之后是RGBA像素
+_HEADER = struct.Struct(">II")
+
+
+def cell_key(image_digest, geometry):
+    """
+    计算单元格缓存的键
+
+    参数:
+        image_digest: 海报图片内容的哈希
+        geometry: 决定单元格结果的全部参数（尺寸、圆角、阴影等）
+    """
+    return hashlib.sha256(
+        f"{CELL_VERSION}|{image_digest}|{geometry!r}".encode("utf-8")
+    ).hexdigest()
+
+
+def _cache_path(key):
+    # 按前两位分子目录，避免单个目录文件过多
+    return os.path.join(CELL_CACHE_FOLDER, key[:2], f"{key}.rgba")
+
+
+def load(key):
+    """
+    内存映射缓存的单元格
+
+    返回:
+        (mmap, (宽, 高)) ，未命中或文件不完整时返回 None
+    """
+    path = _cache_path(key)
+    try:
+        with open(path, "rb") as f:
+            file_size = os.fstat(f.fileno()).st_size
+            if file_size < _HEADER.size:
+                return None
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except OSError:
+        return None
+
+    width, height = _HEADER.unpack_from(mapped)
+    if file_size != _HEADER.size + width * height * 4:
+        mapped.close()
+        return None
+    # 刷新文件时间，避免被过期清理
+    os.utime(path, None)
+    return mapped, (width, height)
+
+
+def pixels(mapped):
+    """返回映射中像素部分的只读视图，可直接用于 Image.frombuffer"""
+    return memoryview(mapped)[_HEADER.size:]
+
+
+def store(key, cell):
+    """把RGBA单元格写入缓存，先写临时文件再改名，中途出错不会留下不完整的缓存"""
+    path = _cache_path(key)
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(temp_path, "wb") as f:
+            f.write(_HEADER.pack(*cell.size))
+            f.write(cell.tobytes())
+        os.replace(temp_path, path)
+    except OSError as e:
+        logger.warning(f"保存单元格缓存失败: {path}, {e}")
+
+
+def prune_cache(max_age_days=None):
+    """删除超过指定天数未使用的单元格缓存"""
+    if max_age_days is None:
+        max_age_days = config.CACHE_CONFIG["MAX_AGE_DAYS"]
+    removed = prune_folder(CELL_CACHE_FOLDER, max_age_days)
+    if removed:
+        logger.info(f"已清理 {removed} 个超过 {max_age_days} 天未使用的单元格缓存")
+    return removed
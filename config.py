@@ -1,4 +1,5 @@
 import os
+import re
 import json
 from logger import get_module_logger
 
@@ -22,6 +23,7 @@ except (FileNotFoundError, json.JSONDecodeError) as e:
 POSTER_FOLDER = os.path.join(CURRENT_DIR, "poster")  # 海报图片文件夹
 TEMPLATE_FOLDER = os.path.join(CURRENT_DIR, "template")  # 模板图片
 OUTPUT_FOLDER = os.path.join(CURRENT_DIR, "output")  # 输出文件夹
+CACHE_FOLDER = os.path.join(CURRENT_DIR, "cache")  # 缓存文件夹
 if isinstance(JSON_CONFIG["jellyfin"], list):
     JELLYFIN_CONFIGS = []  # 如果有多个配置，初始化为空列表
     for json_config in JSON_CONFIG["jellyfin"]:
@@ -40,10 +42,13 @@ if isinstance(JSON_CONFIG["jellyfin"], list):
                 "UPDATE_POSTER": json_config.get(
                     "update_poster", False
                 ),  # 是否更新海报
+                "DOWNLOAD_WORKERS": json_config.get(
+                    "download_workers", 4
+                ),  # 并发下载海报的线程数
             }
         )
 else:
-    JELLYFIN_CONFIG = {
+    _jellyfin_config = {
         "SERVER_NAME": JSON_CONFIG["jellyfin"].get(
             "server_name", JSON_CONFIG["jellyfin"]["base_url"]
         ),
@@ -61,29 +66,38 @@ else:
         "UPDATE_POSTER": JSON_CONFIG["jellyfin"].get(
             "update_poster", False
         ),  # 是否更新海报
+        "DOWNLOAD_WORKERS": JSON_CONFIG["jellyfin"].get(
+            "download_workers", 4
+        ),  # 并发下载海报的线程数
     }
-    JELLYFIN_CONFIGS = [JELLYFIN_CONFIG]
-
-JELLYFIN_CONFIG = {
-    "SERVER_NAME": "",  # 服务器名称
-    "SERVER_TYPE": "",
-    "BASE_URL": "",  # 从JSON配置获取Jellyfin服务地址
-    "USER_NAME": "",  # 用户名
-    "PASSWORD": "",  # 密码
-    "SERVER_NAME": "",
-    "SERVER_TYPE": "",
-    "AUTHORIZATION": 'MediaBrowser Client="other", Device="client", DeviceId="123", Version="0.0.0"',  # 是否需要认证
-    "ACCESS_TOKEN": "",  # API密钥
-    "USER_ID": "",  # 用户ID
-    "IMAGE_TYPE": "Primary",  # 图片类型
-    "IMAGE_PATH": "poster.png",  # 图片文件名
-    "UPDATE_POSTER": False,  # 是否更新海报
-}
+    JELLYFIN_CONFIGS = [_jellyfin_config]
 
 CRON = JSON_CONFIG.get("cron", "0 1 * * *")  # 默认每天1点执行一次
 
 EXCLUDE_LIBRARY = JSON_CONFIG["exclude_update_library"]  # 排除更新的媒体库列表
 
+PARALLEL_SERVERS = JSON_CONFIG.get("parallel_servers", 1)  # 同时处理的服务器数量
+
+ASYNC_NETWORK = JSON_CONFIG.get("async_network", False)  # 是否使用异步网络客户端（需要安装aiohttp）
+
+# 海报生成进程池配置 - 从JSON读取，提供默认值
+_render_pool_json = JSON_CONFIG.get("render_pool", {})
+RENDER_POOL_CONFIG = {
+    "WORKERS": _render_pool_json.get("workers", 1),  # 同时生成海报的进程数，1表示在主进程中逐个生成，0表示使用全部CPU核心
+    "MAX_TASKS_PER_CHILD": _render_pool_json.get("max_tasks_per_child", 4),  # 每个进程生成多少个媒体库后重新创建，0表示不重新创建
+    "TIMEOUT": _render_pool_json.get("timeout", 600),  # 单个媒体库的生成超时时间（秒），0表示不限制
+}
+
+# 下载、生成、上传流水线配置 - 从JSON读取，提供默认值
+_pipeline_json = JSON_CONFIG.get("pipeline", {})
+PIPELINE_CONFIG = {
+    "QUEUE_SIZE": _pipeline_json.get("queue_size", 2),  # 阶段之间最多暂存的媒体库数量
+}
+
+SKIP_UNCHANGED_LIBRARY = JSON_CONFIG.get(
+    "skip_unchanged_library", True
+)  # 媒体库内容和配置没有变化时跳过生成和上传
+
 TEMPLATE_MAPPING = JSON_CONFIG["template_mapping"]
 
 
@@ -106,6 +120,34 @@ POSTER_GEN_CONFIG = {
     "SAVE_COLUMNS": True,  # 是否保存每列图片
     "CELL_WIDTH": 410,  # 海报宽度
     "CELL_HEIGHT": 610,  # 海报高度
+    "TEMPLATE_WIDTH": 1920,  # 静态海报宽度，布局参数均基于此尺寸
+    "TEMPLATE_HEIGHT": 1080,  # 静态海报高度
+}
+
+# HTTP连接配置
+HTTP_CONFIG = {
+    "POOL_MAXSIZE": 8,  # 每个服务器的最小连接池大小
+    "RETRIES": 2,  # GET请求失败时的重试次数
+    "BACKOFF_FACTOR": 0.5,  # 重试间隔系数（秒）
+    "TIMEOUT": 30,  # 请求超时时间（秒）
+    "USER_AGENT": "jellyfin-library-poster",  # 请求头中的User-Agent
+}
+
+# 缓存配置 - 从JSON读取，提供默认值
+_cache_json = JSON_CONFIG.get("cache_config", {})
+CACHE_CONFIG = {
+    "ARTWORK_CACHE": _cache_json.get("artwork_cache", True),  # 是否缓存下载的海报
+    "RENDER_CACHE": _cache_json.get("render_cache", True),  # 是否缓存生成的海报，渲染输入相同时直接复用
+    "CELL_CACHE": _cache_json.get("cell_cache", True),  # 是否缓存处理好的海报单元格（缩放、圆角和阴影）
+    "MAX_AGE_DAYS": _cache_json.get("max_age_days", 30),  # 缓存多少天未使用后清理
+}
+
+# 图片下载配置 - 从JSON读取，提供默认值
+_download_json = JSON_CONFIG.get("download_config", {})
+DOWNLOAD_CONFIG = {
+    "SERVER_RESIZE": _download_json.get("server_resize", True),  # 是否让服务器按渲染尺寸缩放图片
+    "QUALITY": _download_json.get("quality", 90),  # 服务器重新编码的图片质量
+    "FORMAT": _download_json.get("format", "Jpg"),  # 服务器重新编码的图片格式
 }
 
 # 海报下载配置
@@ -124,58 +166,162 @@ ANIMATION_CONFIG = {
     "POSTER_COUNT": _poster_count,
     "FRAME_COUNT": _animation_json.get("frame_count", 60),
     "FRAME_DURATION": _animation_json.get("frame_duration", 60),
+    "SCROLL_SPEED": _animation_json.get("scroll_speed", 0),  # 滚动速度（像素/秒），0表示按帧数计算
     "OUTPUT_FORMAT": _animation_json.get("output_format", "WEBP").upper(),
     "OUTPUT_WIDTH": _animation_json.get("output_width", 560),
     "OUTPUT_HEIGHT": _animation_json.get("output_height", 315),
     "GIF_COLORS": _animation_json.get("gif_colors", 256),
+    "GIF_OPTIMIZE": _animation_json.get("gif_optimize", True),  # GIF使用多帧采样调色板，只写入变化的像素
+    "WEBP_QUALITY": _animation_json.get("webp_quality", 85),  # WebP压缩质量（1-100）
+    "WEBP_METHOD": _animation_json.get("webp_method", 4),  # WebP压缩方法（0-6），越高越慢但文件越小
+    "WEBP_LOSSLESS": _animation_json.get("webp_lossless", False),  # WebP是否使用无损压缩
+    "WEBP_MINIMIZE_SIZE": _animation_json.get("webp_minimize_size", False),  # WebP以最小体积为目标编码，更慢
+    "WEBP_KMIN": _animation_json.get("webp_kmin"),  # WebP关键帧最小间隔，None表示使用编码器默认值
+    "WEBP_KMAX": _animation_json.get("webp_kmax"),  # WebP关键帧最大间隔，None表示使用编码器默认值
+    "AVIF_QUALITY": _animation_json.get("avif_quality", 75),  # AVIF压缩质量（0-100）
+    "AVIF_SPEED": _animation_json.get("avif_speed", 8),  # AVIF编码速度（0-10），越低越慢但文件越小
+    "APNG_COMPRESS_LEVEL": _animation_json.get("apng_compress_level", 6),  # APNG压缩级别（0-9）
+    "RENDER_WORKERS": _animation_json.get("render_workers", 1),  # 渲染动画帧的进程数，0表示使用全部CPU核心
+    "MAX_BYTES": _animation_json.get("max_bytes", 0),  # 动态海报文件大小上限（字节），0表示不限制
+}
+
+# 静态海报输出配置 - 从JSON读取，提供默认值
+_static_json = JSON_CONFIG.get("static_config", {})
+_static_format = _static_json.get("format", "PNG").upper()
+STATIC_CONFIG = {
+    "FORMAT": "JPEG" if _static_format == "JPG" else _static_format,  # 输出格式：PNG、JPEG、WEBP、AVIF
+    "QUALITY": _static_json.get("quality", 90),  # 有损格式的压缩质量（1-100）
+    "EFFORT": _static_json.get("effort", 4),  # 压缩力度（0-6），越高越慢但文件越小
+    "LOSSLESS": _static_json.get("lossless", False),  # WebP/AVIF/JPEG 是否使用无损（或最高质量）压缩
+    "MAX_BYTES": _static_json.get("max_bytes", 0),  # 静态海报文件大小上限（字节），0表示不限制
+}
+
+# 输出格式对应的文件扩展名和上传时使用的 Content-Type
+OUTPUT_FORMATS = {
+    "PNG": ("png", "image/png"),
+    "JPEG": ("jpg", "image/jpeg"),
+    "WEBP": ("webp", "image/webp"),
+    "AVIF": ("avif", "image/avif"),
+    "GIF": ("gif", "image/gif"),
+    "APNG": ("png", "image/png"),
 }
+STATIC_FORMATS = ("PNG", "JPEG", "WEBP", "AVIF")  # 静态海报支持的格式
+ANIMATED_FORMATS = ("GIF", "WEBP", "AVIF", "APNG")  # 动态海报支持的格式
+
+
+def get_output_format(animated):
+    """
+    获取当前配置的输出格式，不支持的格式回退为默认格式
+
+    参数:
+        animated: 是否为动态海报
+
+    返回:
+        str: 格式名称，如 "PNG"、"WEBP"
+    """
+    if animated:
+        output_format = ANIMATION_CONFIG["OUTPUT_FORMAT"]
+        return output_format if output_format in ANIMATED_FORMATS else "GIF"
+    output_format = STATIC_CONFIG["FORMAT"]
+    return output_format if output_format in STATIC_FORMATS else "PNG"
+
+
+def get_output_file(server, name, animated):
+    """
+    获取媒体库海报的输出路径和上传时使用的 Content-Type，文件扩展名跟随输出格式
+
+    参数:
+        server: 服务器上下文
+        name: 媒体库名称
+        animated: 是否为动态海报
+
+    返回:
+        tuple: (文件路径, Content-Type)
+    """
+    extension, content_type = OUTPUT_FORMATS[get_output_format(animated)]
+    return os.path.join(server["OUTPUT_DIR"], f"{name}.{extension}"), content_type
+
+
+def get_render_cell_size():
+    """
+    获取当前渲染模式下单张海报的实际尺寸
+
+    返回:
+        tuple: (宽度, 高度)，动画模式下按输出宽度等比缩放
+    """
+    cell_width = POSTER_GEN_CONFIG["CELL_WIDTH"]
+    cell_height = POSTER_GEN_CONFIG["CELL_HEIGHT"]
+    if ANIMATION_CONFIG["ENABLED"]:
+        scale_factor = ANIMATION_CONFIG["OUTPUT_WIDTH"] / POSTER_GEN_CONFIG["TEMPLATE_WIDTH"]
+        cell_width = int(cell_width * scale_factor)
+        cell_height = int(cell_height * scale_factor)
+    return cell_width, cell_height
+
+
+def create_server_context(server_config):
+    """
+    为一次任务创建独立的服务器上下文
+
+    上下文是服务器配置的副本，认证信息和目录只写入上下文，
+    多个服务器可以同时处理而互不影响
+
+    参数:
+        server_config: JELLYFIN_CONFIGS 中的服务器配置
+
+    返回:
+        dict: 服务器上下文
+    """
+    server = dict(server_config)
+    # 服务器名称可能是地址，去掉路径中不允许的字符后作为子目录名
+    dir_name = re.sub(r'[\\/:*?"<>|\s]+', "_", server["SERVER_NAME"]).strip("_")
+    server["POSTER_DIR"] = os.path.join(POSTER_FOLDER, dir_name or "default")
+    server["OUTPUT_DIR"] = os.path.join(OUTPUT_FOLDER, dir_name or "default")
+    server["ACCESS_TOKEN"] = ""
+    server["USER_ID"] = ""
+    return server
 
 
 # 初始化认证信息
-def init_auth():
-    """初始化认证信息并更新JELLYFIN_CONFIG"""
+def init_auth(server):
+    """初始化认证信息并更新服务器上下文"""
     from auth import authenticate
 
     # 进行认证
-    logger.info(f"正在初始化服务器 {JELLYFIN_CONFIG['SERVER_NAME']} 的认证信息")
-    auth_info = authenticate(
-        JELLYFIN_CONFIG["BASE_URL"],
-        JELLYFIN_CONFIG["USER_NAME"],
-        JELLYFIN_CONFIG["PASSWORD"],
-    )
+    logger.info(f"正在初始化服务器 {server['SERVER_NAME']} 的认证信息")
+    auth_info = authenticate(server)
 
     if auth_info:
-        # 更新JELLYFIN_CONFIG
-        JELLYFIN_CONFIG["ACCESS_TOKEN"] = auth_info.get("access_token", "")
-        JELLYFIN_CONFIG["USER_ID"] = auth_info.get("user_id", "")
-        logger.info(f"认证信息已更新: 用户ID={JELLYFIN_CONFIG['USER_ID'][:8]}...")
+        # 更新服务器上下文
+        server["ACCESS_TOKEN"] = auth_info.get("access_token", "")
+        server["USER_ID"] = auth_info.get("user_id", "")
+        logger.info(f"认证信息已更新: 用户ID={server['USER_ID'][:8]}...")
         return True
     else:
-        logger.error("认证失败，无法获取认证信息")
+        logger.error(f"[{server['SERVER_NAME']}] 认证失败，无法获取认证信息")
         return False
 
 
 # 获取认证信息
-def get_auth_info():
+def get_auth_info(server):
     """获取认证信息，如果尚未认证则进行认证"""
     # 如果尚未进行认证，先初始化认证
-    if not JELLYFIN_CONFIG["ACCESS_TOKEN"] or not JELLYFIN_CONFIG["USER_ID"]:
+    if not server["ACCESS_TOKEN"] or not server["USER_ID"]:
         logger.debug("未找到有效的令牌，重新进行认证")
-        init_auth()
+        init_auth(server)
 
     # 返回认证相关信息
     return {
-        "user_id": JELLYFIN_CONFIG["USER_ID"],
-        "access_token": JELLYFIN_CONFIG["ACCESS_TOKEN"],
-        "base_url": JELLYFIN_CONFIG["BASE_URL"],
+        "user_id": server["USER_ID"],
+        "access_token": server["ACCESS_TOKEN"],
+        "base_url": server["BASE_URL"],
     }
 
 
 # 刷新认证信息
-def refresh_auth():
+def refresh_auth(server):
     """强制刷新认证信息"""
-    logger.info("强制刷新认证信息")
-    return init_auth()
+    logger.info(f"[{server['SERVER_NAME']}] 强制刷新认证信息")
+    return init_auth(server)
 
 
 # 模块加载时不自动进行认证，改为按需认证
@@ -0,0 +1,45 @@
+"""
+动画帧计划
+根据一个循环周期的移动距离和目标滚动速度确定帧数、每帧移动的像素数和帧持续时间，
+每帧都移动相同的整数像素，帧数刚好构成一个无缝循环
+"""
+
+from collections import namedtuple
+
+# frame_count: 帧数; step: 每帧移动的像素数，None 表示无法使用整数步长; duration: 帧持续时间（毫秒）
+FramePlan = namedtuple("FramePlan", ["frame_count", "step", "duration"])
+
+
+def plan_frames(period, frame_duration, scroll_speed=0, frame_count=60):
+    """
+    计算动画的帧计划
+
+    步长必须能整除循环周期，从中选择最接近目标速度的步长，
+    再调整帧持续时间使实际速度与目标一致
+
+    参数:
+        period: 一个循环周期的移动距离（像素）
+        frame_duration: 配置的帧持续时间（毫秒）
+        scroll_speed: 目标滚动速度（像素/秒），0 表示使用 frame_count 帧完成一个周期的速度
+        frame_count: 配置的帧数，scroll_speed 为 0 时使用
+
+    返回:
+        FramePlan，找不到合适的整数步长时 step 为 None，帧数和持续时间保持配置值
+    """
+    if scroll_speed > 0:
+        target_step = scroll_speed * frame_duration / 1000
+    else:
+        target_step = period / max(1, frame_count)
+
+    # 与目标步长相差一倍以内、能整除周期的步长；目标不足1像素时每帧移动1像素
+    candidates = [
+        step
+        for step in range(1, period + 1)
+        if period % step == 0 and target_step / 2 <= step <= max(1, target_step * 2)
+    ]
+    if not candidates:
+        return FramePlan(max(1, round(period / target_step)), None, frame_duration)
+
+    step = min(candidates, key=lambda candidate: abs(candidate - target_step))
+    duration = max(1, round(frame_duration * step / target_step))
+    return FramePlan(period // step, step, duration)
@@ -0,0 +1,145 @@
+"""
+动画帧并行渲染模块
+渲染需要的只读图片（背景、旋转后的列、文字覆盖层等）只复制一次到共享内存，
+工作进程直接映射使用，每个任务只传递帧序号
+"""
+
+import os
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory, util
+
+from PIL import Image
+from logger import get_module_logger
+
+# 获取模块日志记录器
+logger = get_module_logger("frame_pool")
+
+# 放在共享内存中的图片的描述信息
+SharedImage = namedtuple("SharedImage", ["name", "mode", "size"])
+
+# 工作进程中的渲染函数、参数和共享内存
+_worker_state = {}
+
+
+def resolve_workers(workers):
+    """
+    把配置的进程数转换为实际使用的进程数
+
+    参数:
+        workers: 配置的进程数，0或负数表示使用全部CPU核心
+
+    返回:
+        int: 实际使用的进程数，至少为1
+    """
+    if workers is None or workers <= 0:
+        return os.cpu_count() or 1
+    return workers
+
+
+def _share(value, blocks):
+    """把参数中的图片复制到共享内存，其余内容原样保留"""
+    if isinstance(value, Image.Image):
+        data = value.tobytes()
+        shm = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+        blocks.append(shm)
+        shm.buf[: len(data)] = data
+        return SharedImage(shm.name, value.mode, value.size)
+    if isinstance(value, dict):
+        return {key: _share(item, blocks) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(_share(item, blocks) for item in value)
+    return value
+
+
+def _attach(value, blocks):
+    """在工作进程中把共享内存描述还原为图片，不复制数据"""
+    if isinstance(value, SharedImage):
+        try:
+            shm = shared_memory.SharedMemory(name=value.name, track=False)
+        except TypeError:  # Python 3.13 之前没有 track 参数
+            shm = shared_memory.SharedMemory(name=value.name)
+        blocks.append(shm)
+        return Image.frombuffer(
+            value.mode, value.size, shm.buf, "raw", value.mode, 0, 1
+        )
+    if isinstance(value, dict):
+        return {key: _attach(item, blocks) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(_attach(item, blocks) for item in value)
+    return value
+
+
+def _release_worker():
+    """工作进程退出时先释放图片再关闭共享内存"""
+    blocks = _worker_state.get("blocks", [])
+    _worker_state.clear()
+    for shm in blocks:
+        try:
+            shm.close()
+        except BufferError:
+            pass
+
+
+def _init_worker(render_func, shared_args, total_frames):
+    """工作进程初始化：映射共享内存中的图片"""
+    blocks = []
+    _worker_state["render_func"] = render_func
+    _worker_state["args"] = _attach(shared_args, blocks)
+    _worker_state["total_frames"] = total_frames
+    _worker_state["blocks"] = blocks
+    util.Finalize(None, _release_worker, exitpriority=10)
+
+
+def _render_in_worker(frame_index):
+    """在工作进程中渲染一帧，返回原始像素数据"""
+    frame = _worker_state["render_func"](
+        *_worker_state["args"], frame_index, _worker_state["total_frames"]
+    )
+    return frame.mode, frame.size, frame.tobytes()
+
+
+def render_frames(render_func, args, total_frames, workers=1):
+    """
+    按帧序号顺序生成所有帧
+
+    workers 大于1时使用进程池并行渲染，最多只有 workers*2 帧在渲染或等待取走
+
+    参数:
+        render_func: 模块级的渲染函数，调用方式为 render_func(*args, frame_index, total_frames)
+        args: 渲染函数的只读参数，其中的图片会放到共享内存中
+        total_frames: 总帧数
+        workers: 渲染进程数
+
+    返回:
+        生成器，按顺序产生每一帧图片
+    """
+    if workers <= 1 or total_frames <= 1:
+        for frame_index in range(total_frames):
+            yield render_func(*args, frame_index, total_frames)
+        return
+
+    blocks = []
+    try:
+        shared_args = _share(args, blocks)
+        logger.debug(
+            f"使用 {workers} 个进程渲染 {total_frames} 帧，共享内存 {sum(shm.size for shm in blocks) / 1024 / 1024:.1f} MB"
+        )
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(render_func, shared_args, total_frames),
+        ) as executor:
+            pending = deque()
+            next_index = 0
+            while next_index < total_frames or pending:
+                # 保持固定数量的任务在执行，已完成的帧按顺序取走
+                while next_index < total_frames and len(pending) < workers * 2:
+                    pending.append(executor.submit(_render_in_worker, next_index))
+                    next_index += 1
+                mode, size, data = pending.popleft().result()
+                yield Image.frombytes(mode, size, data)
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
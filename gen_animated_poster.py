@@ -3,13 +3,21 @@
 将媒体库封面生成为动态GIF，三列图片像列车一样平行移动
 """
 
-from PIL import Image, ImageFilter, ImageDraw, ImageFont
+from PIL import Image, ImageChops, ImageFilter, ImageDraw, ImageFont
 import os
 import math
+import time
 import config
 from logger import get_module_logger
+from size_budget import fit_to_budget
+import render_cache
+from image_store import ImageStore
+from frame_pool import render_frames, resolve_workers
+from frame_plan import plan_frames
+from animation_encoder import save_apng, save_avif, save_gif, save_webp
 from gen_poster import (
-    add_shadow,
+    create_poster_cell,
+    rotate_to_region,
     create_gradient_background,
     get_poster_primary_color,
     draw_text_on_image,
@@ -22,7 +30,25 @@ from gen_poster import (
 logger = get_module_logger("gen_animated_poster")
 
 
-def create_extended_column(column_posters, cell_width, cell_height, margin, corner_radius):
+# 动态海报单元格固定的阴影偏移、颜色和模糊半径
+CELL_SHADOW = ((20, 20), (0, 0, 0, 255), 20)
+
+
+def _create_cell(poster, cell_width, cell_height, corner_radius):
+    """动态海报使用的单元格"""
+    shadow_offset, shadow_color, blur_radius = CELL_SHADOW
+    return create_poster_cell(
+        poster,
+        cell_width,
+        cell_height,
+        corner_radius,
+        shadow_offset=shadow_offset,
+        shadow_color=shadow_color,
+        blur_radius=blur_radius,
+    )
+
+
+def create_extended_column(column_posters, cell_width, cell_height, margin, corner_radius, images=None):
     """
     创建扩展高度的列图片（将图片复制一份在下方），用于无缝循环动画
     
@@ -32,6 +58,7 @@ def create_extended_column(column_posters, cell_width, cell_height, margin, corn
         cell_height: 单张海报高度
         margin: 海报间距
         corner_radius: 圆角半径
+        images: ImageStore，为 None 时直接打开文件
         
     返回:
         扩展后的列图片（高度翻倍）
@@ -51,163 +78,186 @@ def create_extended_column(column_posters, cell_width, cell_height, margin, corn
         (0, 0, 0, 0),
     )
     
+    # 每张海报只处理一次，两份复制共用同一个单元格图片
+    cells = []
+    for poster_path in column_posters:
+        try:
+            # 调整海报大小并添加圆角和阴影
+            if images is not None:
+                cells.append(images.get_cell(
+                    poster_path,
+                    (cell_width, cell_height, corner_radius) + CELL_SHADOW,
+                    lambda poster: _create_cell(poster, cell_width, cell_height, corner_radius),
+                ))
+            else:
+                with Image.open(poster_path) as poster:
+                    cells.append(_create_cell(poster, cell_width, cell_height, corner_radius))
+        except Exception as e:
+            logger.error(f"处理图片 {os.path.basename(poster_path)} 时出错: {e}")
+            cells.append(None)
+
     # 放置两份图片（上下复制）
     for copy_index in range(2):
         base_y = copy_index * (single_column_height + margin)
-        
-        for row_index, poster_path in enumerate(column_posters):
-            try:
-                # 打开海报
-                poster = Image.open(poster_path)
-                
-                # 调整海报大小为固定尺寸
-                resized_poster = poster.resize(
-                    (cell_width, cell_height), Image.LANCZOS
-                )
-                
-                # 创建圆角遮罩（如果需要）
-                if corner_radius > 0:
-                    mask = Image.new("L", (cell_width, cell_height), 0)
-                    draw = ImageDraw.Draw(mask)
-                    draw.rounded_rectangle(
-                        [(0, 0), (cell_width, cell_height)],
-                        radius=corner_radius,
-                        fill=255,
-                    )
-                    poster_with_corners = Image.new(
-                        "RGBA", resized_poster.size, (0, 0, 0, 0)
-                    )
-                    poster_with_corners.paste(resized_poster, (0, 0), mask)
-                    resized_poster = poster_with_corners
-                
-                # 添加阴影效果
-                resized_poster_with_shadow = add_shadow(
-                    resized_poster,
-                    offset=(20, 20),
-                    shadow_color=(0, 0, 0, 255),
-                    blur_radius=20,
-                )
-                
-                # 计算在列画布上的位置
-                y_position = base_y + row_index * (cell_height + margin)
-                
-                # 粘贴到列画布上
-                column_image.paste(
-                    resized_poster_with_shadow,
-                    (0, y_position),
-                    resized_poster_with_shadow,
-                )
-                
-            except Exception as e:
-                logger.error(f"处理图片 {os.path.basename(poster_path)} 时出错: {e}")
+
+        for row_index, cell in enumerate(cells):
+            if cell is None:
                 continue
-    
-    return column_image, single_column_height
-
-
-def generate_animation_frame(
-    gradient_bg, 
-    extended_columns, 
-    column_heights,
-    frame_index, 
-    total_frames,
-    rotation_angle,
-    start_x,
-    start_y,
-    column_spacing,
-    cell_width,
-    cell_height,
-    cols,
-    margin,
-    scale_factor=1.0
-):
+
+            # 计算在列画布上的位置
+            y_position = base_y + row_index * (cell_height + margin)
+
+            # 粘贴到列画布上
+            column_image.paste(cell, (0, y_position), cell)
+
+    # 按自身透明度贴到透明画布上，阴影深浅与原来放入旋转画布后的效果一致
+    faded_column = Image.new("RGBA", column_image.size, (0, 0, 0, 0))
+    faded_column.paste(column_image, (0, 0), column_image)
+
+    return faded_column, single_column_height
+
+
+def get_column_position(col_index, start_x, start_y, column_spacing, cell_width, single_height, scale_factor=1.0):
+    """
+    计算列的旋转中心在画面上的位置
+
+    参数:
+        col_index: 列索引
+        single_height: 单列高度
+        其他参数: 布局配置
+
+    返回:
+        (x, y)，列的中心点在画面上的坐标
+    """
+    column_x = start_x + col_index * column_spacing
+    column_center_y = start_y + single_height // 2
+    column_center_x = column_x
+
+    # 根据列索引调整位置 - 需要按比例缩放调整值
+    # 这些值是基于原始1920x1080分辨率的调整
+    if col_index == 1:
+        column_center_x += cell_width - int(50 * scale_factor)
+    elif col_index == 2:
+        column_center_y += int(-155 * scale_factor)
+        column_center_x += (cell_width) * 2 - int(40 * scale_factor)
+
+    return column_center_x + cell_width / 2, column_center_y
+
+
+def create_scrolling_column(extended_column, single_height, margin, rotation_angle, position, canvas_size):
+    """
+    把扩展列整体旋转一次，之后每一帧只需要沿列方向平移和裁剪
+
+    每一帧显示的是扩展列中一段固定高度的窗口，窗口在画面上的位置不变，
+    只有列内容沿旋转后的列方向移动
+
+    参数:
+        extended_column: 扩展后的列图片
+        single_height: 单列高度
+        margin: 海报间距
+        rotation_angle: 旋转角度
+        position: 窗口中心在画面上的位置
+        canvas_size: 画面尺寸 (宽, 高)
+
+    返回:
+        dict: 旋转后的列和逐帧平移需要的参数
+    """
+    # 裁剪窗口的高度，包含阴影需要的额外空间
+    shadow_extra = 20 + 20 * 2
+    window_height = single_height + shadow_extra
+
+    # 整条扩展列只旋转一次，记录列坐标原点在旋转图中的位置
+    rotated, (left, top) = rotate_to_region(
+        extended_column, rotation_angle, (0, 0), (0, 0)
+    )
+    radians = -math.radians(rotation_angle)
+
+    # 窗口在画面上固定不动，覆盖整个画面时不需要额外裁剪
+    window_layer, window_position = rotate_to_region(
+        Image.new("L", (extended_column.width, window_height), 255),
+        rotation_angle,
+        (extended_column.width / 2, window_height / 2),
+        position,
+        bounds=canvas_size,
+    )
+    window = Image.new("L", canvas_size, 0)
+    if window_layer is not None:
+        window.paste(window_layer, window_position)
+    if window.getextrema() == (255, 255):
+        window = None
+
+    return {
+        "image": rotated,
+        "origin": (-left, -top),  # 列坐标原点在旋转图中的位置
+        "cos": math.cos(radians),
+        "sin": math.sin(radians),
+        "pivot_x": extended_column.width / 2,
+        "window_height": window_height,
+        "window": window,
+        "position": position,
+        "single_height": single_height,
+        "period": single_height + margin,  # 一个循环周期的移动距离
+    }
+
+
+def generate_animation_frame(gradient_bg, scrolling_columns, frame_index, total_frames):
     """
     生成单帧动画图片
-    
+
     参数:
         gradient_bg: 渐变背景
-        extended_columns: 扩展后的列图片列表
-        column_heights: 单列高度列表
+        scrolling_columns: create_scrolling_column 生成的列列表
         frame_index: 当前帧索引
         total_frames: 总帧数
-        其他参数: 布局配置
-        
+
     返回:
         当前帧的完整图片
     """
     result = gradient_bg.copy()
-    
-    # 计算当前帧的偏移量（一个完整周期移动一个图片+间距的距离）
-    # 使用传入的已缩放 margin，确保与 column_heights 计算一致
-    move_distance = column_heights[0] + margin  # 一个循环周期的移动距离
-    progress = frame_index / total_frames
-    base_offset = int(progress * move_distance)
-    
-    for col_index, (extended_column, single_height) in enumerate(zip(extended_columns, column_heights)):
-        if col_index >= cols:
-            break
-        
+
+    # 计算当前帧的偏移量（一个完整周期移动一个图片+间距的距离），
+    # 帧数能整除周期时每帧移动相同的整数像素
+    move_distance = scrolling_columns[0]["period"]
+    base_offset = frame_index * move_distance // total_frames
+
+    for col_index, column in enumerate(scrolling_columns):
         # 根据列索引确定移动方向
         # 第1列(0): 向上, 第2列(1): 向下, 第3列(2): 向上
         if col_index == 1:
             offset = base_offset  # 向下移动（正偏移）
         else:
             offset = -base_offset  # 向上移动（负偏移）
-        
-        # 从扩展列中裁剪出当前帧需要显示的部分
-        # 计算裁剪区域
-        shadow_extra = 20 + 20 * 2
-        
-        # 调整偏移确保在有效范围内
-        crop_y_start = single_height // 2 + offset
-        crop_y_start = crop_y_start % (single_height + margin)
-        
-        # 裁剪出需要的部分
-        cropped_column = extended_column.crop((
-            0,
-            crop_y_start,
-            extended_column.width,
-            crop_y_start + single_height + shadow_extra
-        ))
-        
-        # 旋转列
-        rotation_canvas_size = int(
-            math.sqrt(
-                cropped_column.width ** 2 + cropped_column.height ** 2
-            ) * 1.5
-        )
-        rotation_canvas = Image.new(
-            "RGBA", (rotation_canvas_size, rotation_canvas_size), (0, 0, 0, 0)
-        )
-        
-        paste_x = (rotation_canvas_size - cropped_column.width) // 2
-        paste_y = (rotation_canvas_size - cropped_column.height) // 2
-        rotation_canvas.paste(cropped_column, (paste_x, paste_y), cropped_column)
-        
-        rotated_column = rotation_canvas.rotate(
-            rotation_angle, Image.BICUBIC, expand=True
-        )
-        
-        # 计算列在模板上的位置
-        column_x = start_x + col_index * column_spacing
-        column_center_y = start_y + single_height // 2
-        column_center_x = column_x
-        
-        # 根据列索引调整位置 - 需要按比例缩放调整值
-        # 这些值是基于原始1920x1080分辨率的调整
-        if col_index == 1:
-            column_center_x += cell_width - int(50 * scale_factor)
-        elif col_index == 2:
-            column_center_y += int(-155 * scale_factor)
-            column_center_x += (cell_width) * 2 - int(40 * scale_factor)
-        
-        # 计算最终放置位置
-        final_x = column_center_x - rotated_column.width // 2 + cell_width // 2
-        final_y = column_center_y - rotated_column.height // 2
-        
-        # 粘贴旋转后的列到结果图像
-        result.paste(rotated_column, (final_x, final_y), rotated_column)
-    
+
+        # 调整偏移确保在有效范围内，得到当前帧窗口在扩展列中的起点
+        crop_y_start = (column["single_height"] // 2 + offset) % column["period"]
+
+        # 窗口中心在旋转图中的位置，平移旋转图使它落在画面上的固定位置
+        pivot_x = column["pivot_x"]
+        pivot_y = crop_y_start + column["window_height"] / 2
+        origin_x, origin_y = column["origin"]
+        cos_a, sin_a = column["cos"], column["sin"]
+        rotated_x = origin_x + cos_a * pivot_x - sin_a * pivot_y
+        rotated_y = origin_y + sin_a * pivot_x + cos_a * pivot_y
+        dest_x = round(column["position"][0] - rotated_x)
+        dest_y = round(column["position"][1] - rotated_y)
+
+        # 只裁剪落在画面内的部分
+        rotated = column["image"]
+        left, top = max(0, dest_x), max(0, dest_y)
+        right = min(result.width, dest_x + rotated.width)
+        bottom = min(result.height, dest_y + rotated.height)
+        if left >= right or top >= bottom:
+            continue
+        layer = rotated.crop((left - dest_x, top - dest_y, right - dest_x, bottom - dest_y))
+
+        # 窗口以外的内容不显示
+        mask = layer.getchannel("A")
+        if column["window"] is not None:
+            mask = ImageChops.multiply(mask, column["window"].crop((left, top, right, bottom)))
+
+        # 粘贴当前帧的列到结果图像
+        result.paste(layer, (left, top), mask)
+
     return result
 
 
@@ -320,32 +370,85 @@ def add_text_overlay(result, name, poster_files, scale_factor=1.0, color_block_c
     return result
 
 
-def gen_animated_poster_workflow(name):
+def render_animation_frame(gradient_bg, scrolling_columns, text_overlay, frame_index, total_frames):
+    """
+    渲染一帧完整的动画图片（列和文字覆盖层），供 frame_pool 在工作进程中调用
+
+    参数:
+        gradient_bg: 渐变背景
+        scrolling_columns: create_scrolling_column 生成的列列表
+        text_overlay: 文字覆盖层
+        frame_index: 当前帧索引
+        total_frames: 总帧数
+
+    返回:
+        当前帧的完整图片
+    """
+    frame = generate_animation_frame(gradient_bg, scrolling_columns, frame_index, total_frames)
+    # 叠加预先绘制的文字覆盖层
+    frame.alpha_composite(text_overlay)
+    return frame
+
+
+def create_text_overlay(size, name, poster_files, scale_factor=1.0, color_block_color=None):
+    """
+    预先绘制文字和色块覆盖层，所有帧共用，避免每一帧重复加载字体和绘制
+
+    分别在纯黑和纯白背景上绘制一次，两者的差值就是覆盖层的透明度，
+    叠加到帧上的效果与直接在帧上绘制相同（包括文字阴影的叠加方式）
+
+    参数:
+        size: 帧尺寸 (宽, 高)
+        name: 媒体库名称
+        poster_files: 海报文件列表
+        scale_factor: 缩放比例，用于调整字体大小和位置
+        color_block_color: 色块颜色
+
+    返回:
+        RGBA格式的覆盖层
+    """
+    on_black = add_text_overlay(
+        Image.new("RGBA", size, (0, 0, 0, 255)), name, poster_files, scale_factor, color_block_color
+    ).convert("RGB")
+    on_white = add_text_overlay(
+        Image.new("RGBA", size, (255, 255, 255, 255)), name, poster_files, scale_factor, color_block_color
+    ).convert("RGB")
+
+    # 背景透出的比例 = (白底结果 - 黑底结果) / 255，黑底结果即预乘透明度后的颜色
+    alpha = ImageChops.invert(ImageChops.subtract(on_white, on_black).convert("L"))
+    return Image.merge("RGBa", (*on_black.split(), alpha)).convert("RGBA")
+
+
+def gen_animated_poster_workflow(server, name):
     """
     生成动态GIF海报的主工作流
     
     参数:
+        server: 服务器上下文
         name: 媒体库名称
         
     返回:
         成功返回True，失败返回False
     """
+    # 每张海报只解码一次，主色调提取至少需要 200x300
+    cell_size = config.get_render_cell_size()
+    images = ImageStore((max(cell_size[0], 200), max(cell_size[1], 300)))
     try:
         logger.info(
-            f"[{config.JELLYFIN_CONFIG['SERVER_NAME']}][{name}] [3/4] 正在生成动态海报..."
+            f"[{server['SERVER_NAME']}][{name}] [3/4] 正在生成动态海报..."
         )
         logger.info("-" * 40)
         
-        poster_folder = os.path.join(config.POSTER_FOLDER, name)
-        output_path = os.path.join(config.OUTPUT_FOLDER, f"{name}.gif")
+        poster_folder = os.path.join(server["POSTER_DIR"], name)
+        output_path, _ = config.get_output_file(server, name, animated=True)
         
-        # 清理旧的动图文件（GIF和WebP）
-        old_gif = os.path.join(config.OUTPUT_FOLDER, f"{name}.gif")
-        old_webp = os.path.join(config.OUTPUT_FOLDER, f"{name}.webp")
-        for old_file in [old_gif, old_webp]:
+        # 清理旧的动图文件（所有动态格式）
+        extensions = sorted({config.OUTPUT_FORMATS[fmt][0] for fmt in config.ANIMATED_FORMATS})
+        for extension in extensions:
+            old_file = os.path.join(server["OUTPUT_DIR"], f"{name}.{extension}")
             if os.path.exists(old_file):
                 os.remove(old_file)
-                logger.info(f"[{config.JELLYFIN_CONFIG['SERVER_NAME']}][{name}] 已删除旧文件: {old_file}")
+                logger.info(f"[{server['SERVER_NAME']}][{name}] 已删除旧文件: {old_file}")
         
         # 从配置获取参数
         cols = config.POSTER_GEN_CONFIG["COLS"]  # 固定3列
@@ -357,7 +460,7 @@ def gen_animated_poster_workflow(name):
         if rows < 3:
             rows = 3  # 最少3行
         
-        logger.info(f"[{config.JELLYFIN_CONFIG['SERVER_NAME']}][{name}] 使用 {rows}行×{cols}列 布局，共 {rows * cols} 张图片")
+        logger.info(f"[{server['SERVER_NAME']}][{name}] 使用 {rows}行×{cols}列 布局，共 {rows * cols} 张图片")
         
         # 动画参数
         frame_count = config.ANIMATION_CONFIG["FRAME_COUNT"]
@@ -365,8 +468,8 @@ def gen_animated_poster_workflow(name):
         
         # 模板尺寸 - 使用720p以减小文件体积
         # 原始尺寸1920x1080，720p为1280x720
-        original_width = 1920
-        original_height = 1080
+        original_width = config.POSTER_GEN_CONFIG["TEMPLATE_WIDTH"]
+        original_height = config.POSTER_GEN_CONFIG["TEMPLATE_HEIGHT"]
         template_width = config.ANIMATION_CONFIG.get("OUTPUT_WIDTH", 1280)
         template_height = config.ANIMATION_CONFIG.get("OUTPUT_HEIGHT", 720)
         
@@ -382,7 +485,7 @@ def gen_animated_poster_workflow(name):
         cell_width = int(config.POSTER_GEN_CONFIG["CELL_WIDTH"] * scale_factor)
         cell_height = int(config.POSTER_GEN_CONFIG["CELL_HEIGHT"] * scale_factor)
         
-        logger.info(f"[{config.JELLYFIN_CONFIG['SERVER_NAME']}][{name}] 输出分辨率: {template_width}x{template_height}, 缩放比例: {scale_factor:.2f}")
+        logger.info(f"[{server['SERVER_NAME']}][{name}] 输出分辨率: {template_width}x{template_height}, 缩放比例: {scale_factor:.2f}")
         
         # 获取海报文件
         supported_formats = (".jpg", ".jpeg", ".png", ".bmp", ".gif", ".webp")
@@ -420,7 +523,7 @@ def gen_animated_poster_workflow(name):
         
         if not poster_files:
             logger.error(
-                f"[{config.JELLYFIN_CONFIG['SERVER_NAME']}][{name}] 错误: 在 {poster_folder} 中没有找到支持的图片文件"
+                f"[{server['SERVER_NAME']}][{name}] 错误: 在 {poster_folder} 中没有找到支持的图片文件"
             )
             return False
         
@@ -429,13 +532,27 @@ def gen_animated_poster_workflow(name):
             poster_files[i : i + rows] for i in range(0, len(poster_files), rows)
         ]
         
-        # 获取第一张图片的主色调并创建渐变背景
+        # 渲染输入与之前某次完全相同时，直接使用缓存的动态海报
         first_image_path = os.path.join(poster_folder, "1.jpg")
-        color = get_poster_primary_color(first_image_path)
-        gradient_bg = create_gradient_background(template_width, template_height, name, color)
+        render_key = render_cache.compute_render_key(
+            name, [first_image_path] + poster_files, animated=True
+        )
+        if render_cache.restore(render_key, output_path):
+            logger.info(
+                f"[{server['SERVER_NAME']}][{name}] 渲染输入未变化（{render_key[:12]}），使用缓存的动态海报: {output_path}"
+            )
+            return True
+        # 随机选择的颜色由渲染输入决定，相同输入总是生成相同的海报
+        rng = render_cache.create_rng(render_key)
+        
+        # 获取第一张图片的主色调并创建渐变背景
+        color = get_poster_primary_color(first_image_path, images=images)
+        gradient_bg = create_gradient_background(
+            server, template_width, template_height, name, color, rng=rng
+        )
         
         # 创建扩展高度的列图片
-        logger.info(f"[{config.JELLYFIN_CONFIG['SERVER_NAME']}][{name}] 正在创建扩展列图片...")
+        logger.info(f"[{server['SERVER_NAME']}][{name}] 正在创建扩展列图片...")
         extended_columns = []
         column_heights = []
         
@@ -443,115 +560,215 @@ def gen_animated_poster_workflow(name):
             if col_index >= cols:
                 break
             extended_col, single_height = create_extended_column(
-                column_posters, cell_width, cell_height, margin, corner_radius
+                column_posters, cell_width, cell_height, margin, corner_radius, images
             )
             extended_columns.append(extended_col)
             column_heights.append(single_height)
         
+        # 每一列只旋转一次，逐帧只做平移和裁剪
+        scrolling_columns = []
+        for col_index, (extended_col, single_height) in enumerate(zip(extended_columns, column_heights)):
+            position = get_column_position(
+                col_index, start_x, start_y, column_spacing, cell_width, single_height, scale_factor
+            )
+            scrolling_columns.append(
+                create_scrolling_column(
+                    extended_col,
+                    single_height,
+                    margin,
+                    rotation_angle,
+                    position,
+                    (template_width, template_height),
+                )
+            )
+        
+        # 根据循环周期和目标速度确定帧数，每帧移动相同的整数像素
+        period = scrolling_columns[0]["period"]
+        plan = plan_frames(
+            period, frame_duration, config.ANIMATION_CONFIG["SCROLL_SPEED"], frame_count
+        )
+        frame_count, frame_duration = plan.frame_count, plan.duration
+        if plan.step is None:
+            logger.info(
+                f"[{server['SERVER_NAME']}][{name}] 循环周期 {period} 像素没有接近目标速度的整数步长，每帧移动距离会有1像素的差异"
+            )
+        else:
+            logger.info(
+                f"[{server['SERVER_NAME']}][{name}] 循环周期 {period} 像素，每帧移动 {plan.step} 像素，"
+                f"帧持续时间 {frame_duration} 毫秒，速度 {plan.step * 1000 / frame_duration:.0f} 像素/秒"
+            )
+        
         # 生成所有帧
-        logger.info(f"[{config.JELLYFIN_CONFIG['SERVER_NAME']}][{name}] 正在生成 {frame_count} 帧动画...")
-        frames = []
+        logger.info(f"[{server['SERVER_NAME']}][{name}] 正在生成 {frame_count} 帧动画...")
         
         # 预先计算色块颜色，确保所有帧使用相同颜色避免闪烁
-        color_block_color = get_random_color(poster_files[0]) if poster_files else (128, 128, 128, 255)
-        
-        for frame_index in range(frame_count):
-            frame = generate_animation_frame(
-                gradient_bg,
-                extended_columns,
-                column_heights,
-                frame_index,
-                frame_count,
-                rotation_angle,
-                start_x,
-                start_y,
-                column_spacing,
-                cell_width,
-                cell_height,
-                cols,
-                margin,
-                scale_factor
-            )
-            
-            # 每一帧都添加文字覆盖层，使用预先计算的色块颜色
-            frame = add_text_overlay(frame, name, poster_files, scale_factor, color_block_color)
-            
-            # 保持RGBA格式，在最后保存时统一处理
-            frames.append(frame)
-            
-            if (frame_index + 1) % 10 == 0:
-                logger.info(f"[{config.JELLYFIN_CONFIG['SERVER_NAME']}][{name}] 已生成 {frame_index + 1}/{frame_count} 帧")
+        color_block_color = get_random_color(poster_files[0], rng, images=images) if poster_files else (128, 128, 128, 255)
+        
+        # 文字和色块在所有帧中都相同，只绘制一次
+        text_overlay = create_text_overlay(
+            (template_width, template_height), name, poster_files, scale_factor, color_block_color
+        )
         
-        # 保存为GIF
-        logger.info(f"[{config.JELLYFIN_CONFIG['SERVER_NAME']}][{name}] 正在保存GIF动画...")
+        # 各帧互不依赖，可以用多个进程并行渲染，按顺序取回
+        render_workers = resolve_workers(config.ANIMATION_CONFIG["RENDER_WORKERS"])
+        
+        def generate_frames(total_frames):
+            """按顺序产生每一帧，编码器取走一帧后才继续渲染，不保存全部帧"""
+            for frame_index, frame in enumerate(
+                render_frames(
+                    render_animation_frame,
+                    (gradient_bg, scrolling_columns, text_overlay),
+                    total_frames,
+                    render_workers,
+                )
+            ):
+                yield frame
+                if (frame_index + 1) % 10 == 0:
+                    logger.info(f"[{server['SERVER_NAME']}][{name}] 已生成 {frame_index + 1}/{total_frames} 帧")
         
         # 确保输出目录存在
         output_dir = os.path.dirname(output_path)
         if not os.path.exists(output_dir):
             os.makedirs(output_dir)
         
-        # 根据配置选择输出格式
-        output_format = config.ANIMATION_CONFIG.get("OUTPUT_FORMAT", "GIF").upper()
+        # 超出大小预算时依次减少帧数，帧持续时间相应加长，动画一轮的总时长不变。
+        # 只使用能整除帧数的倍数，每帧仍然移动相同的整数像素
+        max_bytes = config.ANIMATION_CONFIG["MAX_BYTES"]
+        frame_levels = [frame_count]
+        if max_bytes:
+            for divisor in (2, 4):
+                if frame_count % divisor == 0 and frame_count // divisor >= 2:
+                    frame_levels.append(frame_count // divisor)
+        
+        # 根据配置选择输出格式，边生成边编码
+        output_format = config.get_output_format(animated=True)
+        
+        def quality_levels(quality):
+            """超出预算时质量每次降低10"""
+            qualities = list(range(quality, 24, -10)) or [quality]
+            return qualities if max_bytes else qualities[:1]
+        
+        def frame_duration_for(frames):
+            return round(frame_duration * frame_count / frames)
         
         if output_format == "WEBP":
             # 使用WebP格式，支持更多颜色和更好的压缩
-            output_path = output_path.replace(".gif", ".webp")
+            logger.info(f"[{server['SERVER_NAME']}][{name}] 正在生成并保存WebP动画...")
+            webp_lossless = config.ANIMATION_CONFIG["WEBP_LOSSLESS"]
+            # 无损模式超出预算时改用有损压缩
+            qualities = [None] if webp_lossless else []
+            if max_bytes or not webp_lossless:
+                qualities += quality_levels(config.ANIMATION_CONFIG["WEBP_QUALITY"])
+            levels = [(frames, quality) for frames in frame_levels for quality in qualities]
             
-            # 转换帧为RGBX格式（WebP动画需要）
-            webp_frames = []
-            for frame in frames:
-                # 转换为RGBX格式，移除alpha通道
-                webp_frame = frame.convert("RGBX")
-                webp_frames.append(webp_frame)
+            def encode(level, fp):
+                frames, quality = level
+                save_webp(
+                    generate_frames(frames),
+                    fp,
+                    frames,
+                    frame_duration_for(frames),
+                    quality=85 if quality is None else quality,
+                    method=config.ANIMATION_CONFIG["WEBP_METHOD"],
+                    lossless=quality is None,
+                    minimize_size=config.ANIMATION_CONFIG["WEBP_MINIMIZE_SIZE"],
+                    kmin=config.ANIMATION_CONFIG["WEBP_KMIN"],
+                    kmax=config.ANIMATION_CONFIG["WEBP_KMAX"],
+                )
+        elif output_format == "AVIF":
+            # AVIF格式，相同画质下文件通常比WebP小很多，但编码更耗CPU
+            logger.info(f"[{server['SERVER_NAME']}][{name}] 正在生成并保存AVIF动画...")
+            qualities = quality_levels(config.ANIMATION_CONFIG["AVIF_QUALITY"])
+            levels = [(frames, quality) for frames in frame_levels for quality in qualities]
             
-            # 保存为动态WebP
-            webp_frames[0].save(
-                output_path,
-                format="WEBP",
-                save_all=True,
-                append_images=webp_frames[1:],
-                duration=frame_duration,
-                loop=0,
-                quality=85,
-                method=4,  # 压缩方法（0-6，越高越慢但压缩越好）
-            )
-            logger.info(f"[{config.JELLYFIN_CONFIG['SERVER_NAME']}][{name}] WebP动画已保存")
+            def encode(level, fp):
+                frames, quality = level
+                save_avif(
+                    generate_frames(frames),
+                    fp,
+                    frames,
+                    frame_duration_for(frames),
+                    quality=quality,
+                    speed=config.ANIMATION_CONFIG["AVIF_SPEED"],
+                )
+        elif output_format == "APNG":
+            # APNG格式，无损，每帧只写入变化的区域
+            logger.info(f"[{server['SERVER_NAME']}][{name}] 正在生成并保存APNG动画...")
+            levels = [(frames, None) for frames in frame_levels]
+            
+            def encode(level, fp):
+                frames, _ = level
+                save_apng(
+                    generate_frames(frames),
+                    fp,
+                    frame_duration_for(frames),
+                    compress_level=config.ANIMATION_CONFIG["APNG_COMPRESS_LEVEL"],
+                    workers=render_workers,
+                )
         else:
             # GIF格式 - 使用抖动来减少色带
+            logger.info(f"[{server['SERVER_NAME']}][{name}] 正在生成并保存GIF动画...")
             gif_colors = config.ANIMATION_CONFIG.get("GIF_COLORS", 128)
-            gif_frames = []
-            
-            # 基于第一帧生成全局调色板，所有帧共享同一调色板以避免文字闪烁
-            first_frame_rgb = frames[0].convert("RGB")
-            global_palette = first_frame_rgb.quantize(colors=gif_colors, method=Image.Quantize.MEDIANCUT)
-            
-            for i, frame in enumerate(frames):
-                # 先转换为RGB（移除alpha通道）
-                frame_rgb = frame.convert("RGB")
-                # 使用全局调色板进行量化，确保颜色一致性
-                frame_p = frame_rgb.quantize(palette=global_palette, dither=Image.Dither.FLOYDSTEINBERG)
-                gif_frames.append(frame_p)
+            gif_optimize = config.ANIMATION_CONFIG["GIF_OPTIMIZE"]
+            # 从整个动画中均匀抽取几帧生成调色板
+            palette_samples = None
+            if gif_optimize:
+                sample_count = min(8, frame_count)
+                palette_samples = [
+                    render_animation_frame(
+                        gradient_bg, scrolling_columns, text_overlay,
+                        sample_index * frame_count // sample_count, frame_count,
+                    )
+                    for sample_index in range(sample_count)
+                ]
+            color_levels = [gif_colors]
+            if max_bytes:
+                color_levels += [colors for colors in (128, 64, 32) if colors < gif_colors]
+            levels = [(frames, colors) for frames in frame_levels for colors in color_levels]
             
-            gif_frames[0].save(
-                output_path,
-                save_all=True,
-                append_images=gif_frames[1:],
-                duration=frame_duration,
-                loop=0,
-                optimize=False,  # 关闭优化以保持颜色一致性
+            def encode(level, fp):
+                frames, colors = level
+                save_gif(
+                    generate_frames(frames),
+                    fp,
+                    frame_duration_for(frames),
+                    colors,
+                    palette_samples=palette_samples,
+                    optimize=gif_optimize,
+                    workers=render_workers,
+                )
+        
+        encode_start = time.perf_counter()
+        (frames, setting), size, attempts = fit_to_budget(encode, levels, max_bytes, output_path)
+        encode_time = time.perf_counter() - encode_start
+        if output_format == "GIF":
+            setting = f"颜色数 {setting}"
+        else:
+            setting = f"质量 {setting or '无损'}"
+        logger.info(
+            f"[{server['SERVER_NAME']}][{name}] 编码完成: {output_format} {size / 1024:.1f} KB，用时 {encode_time:.2f} 秒，"
+            f"{setting}，帧数 {frames}，编码 {attempts} 次"
+        )
+        if max_bytes and size > max_bytes:
+            logger.warning(
+                f"[{server['SERVER_NAME']}][{name}] 最低质量下仍超出大小预算 {max_bytes / 1024:.1f} KB"
             )
         
+        render_cache.store(render_key, output_path)
         logger.info(
-            f"[{config.JELLYFIN_CONFIG['SERVER_NAME']}][{name}] 成功: 动态海报已保存到 {output_path}"
+            f"[{server['SERVER_NAME']}][{name}] 成功: 动态海报已保存到 {output_path}"
         )
         return True
         
     except Exception as e:
         logger.error(
-            f"[{config.JELLYFIN_CONFIG['SERVER_NAME']}][{name}] 创建动态海报时出错: {e}",
+            f"[{server['SERVER_NAME']}][{name}] 创建动态海报时出错: {e}",
             exc_info=True,
         )
         return False
+    finally:
+        # 媒体库处理完成，释放所有解码的海报
+        images.close()
 
 
 if __name__ == "__main__":
@@ -561,17 +778,20 @@ if __name__ == "__main__":
     # 如果没有配置测试数据，打印使用说明
     test_library = None
     
+    # 使用第一个服务器的目录查找测试数据
+    server = config.create_server_context(config.JELLYFIN_CONFIGS[0])
+    
     # 检查是否有poster文件夹中的测试数据
-    if os.path.exists(config.POSTER_FOLDER):
-        libraries = [d for d in os.listdir(config.POSTER_FOLDER) 
-                    if os.path.isdir(os.path.join(config.POSTER_FOLDER, d))]
+    if os.path.exists(server["POSTER_DIR"]):
+        libraries = [d for d in os.listdir(server["POSTER_DIR"]) 
+                    if os.path.isdir(os.path.join(server["POSTER_DIR"], d))]
         if libraries:
             test_library = libraries[0]
             print(f"找到测试媒体库: {test_library}")
     
     if test_library:
         print(f"正在生成动态海报: {test_library}")
-        gen_animated_poster_workflow(test_library)
+        gen_animated_poster_workflow(server, test_library)
     else:
         print("未找到测试媒体库，请确保 poster 文件夹中有测试数据")
-        print(f"poster文件夹路径: {config.POSTER_FOLDER}")
+        print(f"poster文件夹路径: {server['POSTER_DIR']}")
@@ -1,55 +1,217 @@
-from PIL import Image, ImageFilter, ImageDraw, ImageFont
+from PIL import Image, ImageChops, ImageFilter, ImageDraw, ImageFont
 import os
 import math
+import time
 import config
 import random  # 添加随机模块
 from logger import get_module_logger
+from size_budget import fit_to_budget
+import render_cache
+from image_store import ImageStore
 import colorsys
+from functools import lru_cache
 
 # 获取模块日志记录器
 logger = get_module_logger("gen_poster")
 
 
-def add_shadow(img, offset=(5, 5), shadow_color=(0, 0, 0, 100), blur_radius=3):
+@lru_cache(maxsize=16)
+def get_shadow_template(size, offset=(5, 5), shadow_color=(0, 0, 0, 100), blur_radius=3):
     """
-    给图片添加右侧和底部阴影
+    获取指定尺寸图片的阴影模板，相同参数只模糊一次
+
+    返回的模板会被多次复用，调用方需要先 copy() 再修改
 
     参数:
-        img: 原始图片（PIL.Image对象）
+        size: 原始图片尺寸，(宽, 高)格式
         offset: 阴影偏移量，(x, y)格式
         shadow_color: 阴影颜色，RGBA格式
         blur_radius: 阴影模糊半径
 
     返回:
-        添加了阴影的新图片
+        比原图大一些的透明画布，只包含模糊后的阴影
     """
+    width, height = size
     # 创建一个透明背景，比原图大一些，以容纳阴影
-    shadow_width = img.width + offset[0] + blur_radius * 2
-    shadow_height = img.height + offset[1] + blur_radius * 2
+    shadow_width = width + offset[0] + blur_radius * 2
+    shadow_height = height + offset[1] + blur_radius * 2
 
     shadow = Image.new("RGBA", (shadow_width, shadow_height), (0, 0, 0, 0))
 
-    # 创建阴影层
-    shadow_layer = Image.new("RGBA", img.size, shadow_color)
-
     # 将阴影层粘贴到偏移位置
-    shadow.paste(shadow_layer, (blur_radius + offset[0], blur_radius + offset[1]))
+    shadow.paste(
+        shadow_color,
+        (
+            blur_radius + offset[0],
+            blur_radius + offset[1],
+            blur_radius + offset[0] + width,
+            blur_radius + offset[1] + height,
+        ),
+    )
 
     # 模糊阴影
-    shadow = shadow.filter(ImageFilter.GaussianBlur(blur_radius))
+    return shadow.filter(ImageFilter.GaussianBlur(blur_radius))
+
+
+@lru_cache(maxsize=16)
+def get_rounded_mask(size, corner_radius):
+    """
+    获取圆角遮罩，相同尺寸和半径只绘制一次
+
+    返回的遮罩会被多次复用，调用方不能修改它
+
+    参数:
+        size: 遮罩尺寸，(宽, 高)格式
+        corner_radius: 圆角半径
+
+    返回:
+        L模式的遮罩，圆角矩形内为255
+    """
+    mask = Image.new("L", size, 0)
+    draw = ImageDraw.Draw(mask)
+    draw.rounded_rectangle(
+        [(0, 0), size],
+        radius=corner_radius,
+        fill=255,
+    )
+    return mask
+
+
+def add_shadow(img, offset=(5, 5), shadow_color=(0, 0, 0, 100), blur_radius=3):
+    """
+    给图片添加右侧和底部阴影
 
-    # 创建结果图像
-    result = Image.new("RGBA", shadow.size, (0, 0, 0, 0))
+    参数:
+        img: 原始图片（PIL.Image对象）
+        offset: 阴影偏移量，(x, y)格式
+        shadow_color: 阴影颜色，RGBA格式
+        blur_radius: 阴影模糊半径
 
-    # 将原图粘贴到结果图像上
-    result.paste(img, (blur_radius, blur_radius), img if img.mode == "RGBA" else None)
+    返回:
+        添加了阴影的新图片
+    """
+    # 同一尺寸的阴影都相同，从缓存的模板复制一份
+    shadow_img = get_shadow_template(
+        img.size, tuple(offset), tuple(shadow_color), blur_radius
+    ).copy()
 
     # 合并阴影和原图（保持原图在上层）
-    shadow_img = Image.alpha_composite(shadow, result)
+    if img.mode != "RGBA":
+        img = img.convert("RGBA")
+    shadow_img.alpha_composite(img, (blur_radius, blur_radius))
 
     return shadow_img
 
 
+def create_poster_cell(
+    poster, cell_width, cell_height, corner_radius,
+    shadow_offset=(20, 20), shadow_color=(0, 0, 0, 255), blur_radius=20
+):
+    """
+    把一张海报处理成带圆角和阴影的单元格图片
+
+    参数:
+        poster: 海报图片（PIL.Image对象）
+        cell_width: 单元格宽度
+        cell_height: 单元格高度
+        corner_radius: 圆角半径，为0时不处理圆角
+        shadow_offset: 阴影偏移量
+        shadow_color: 阴影颜色，RGBA格式
+        blur_radius: 阴影模糊半径
+
+    返回:
+        带阴影的单元格图片，比单元格大 偏移量 + 2 * 模糊半径
+    """
+    # 调整海报大小为固定尺寸
+    resized_poster = poster.resize((cell_width, cell_height), Image.LANCZOS)
+    if resized_poster.mode != "RGBA":
+        resized_poster = resized_poster.convert("RGBA")
+
+    # 应用圆角遮罩，海报本身带透明度时与遮罩叠加
+    if corner_radius > 0:
+        mask = get_rounded_mask((cell_width, cell_height), corner_radius)
+        if resized_poster.getextrema()[3][0] < 255:
+            mask = ImageChops.multiply(resized_poster.getchannel("A"), mask)
+        resized_poster.putalpha(mask)
+
+    return add_shadow(
+        resized_poster,
+        offset=shadow_offset,
+        shadow_color=shadow_color,
+        blur_radius=blur_radius,
+    )
+
+
+def rotate_to_region(image, angle, pivot, position, bounds=None, resample=Image.BICUBIC):
+    """
+    把图片绕 pivot 旋转，pivot 落在目标坐标系的 position 处，只计算旋转后的外接区域
+
+    参数:
+        image: 要旋转的图片
+        angle: 旋转角度，方向与 Image.rotate 相同（正数为逆时针）
+        pivot: 旋转中心在 image 中的坐标，(x, y)格式
+        position: 旋转中心在目标坐标系中的坐标，(x, y)格式
+        bounds: 目标画布尺寸 (宽, 高)，提供时只计算落在画布内的部分
+        resample: 重采样方式
+
+    返回:
+        (旋转后的图层, 图层左上角在目标坐标系中的位置)，完全不可见时返回 (None, None)
+    """
+    radians = -math.radians(angle)
+    cos_a, sin_a = math.cos(radians), math.sin(radians)
+    pivot_x, pivot_y = pivot
+    pos_x, pos_y = position
+
+    # 计算旋转后四个角在目标坐标系中的位置，得到外接区域
+    xs, ys = [], []
+    for x, y in ((0, 0), (image.width, 0), (0, image.height), (image.width, image.height)):
+        dx, dy = x - pivot_x, y - pivot_y
+        xs.append(pos_x + cos_a * dx - sin_a * dy)
+        ys.append(pos_y + sin_a * dx + cos_a * dy)
+    left, top = math.floor(min(xs)), math.floor(min(ys))
+    right, bottom = math.ceil(max(xs)), math.ceil(max(ys))
+    if bounds is not None:
+        left, top = max(0, left), max(0, top)
+        right, bottom = min(bounds[0], right), min(bounds[1], bottom)
+    if left >= right or top >= bottom:
+        return None, None
+
+    # 仿射矩阵把区域内的坐标映射回原图坐标
+    dx, dy = left - pos_x, top - pos_y
+    matrix = (
+        cos_a, sin_a, cos_a * dx + sin_a * dy + pivot_x,
+        -sin_a, cos_a, -sin_a * dx + cos_a * dy + pivot_y,
+    )
+    layer = image.transform((right - left, bottom - top), Image.AFFINE, matrix, resample)
+    return layer, (left, top)
+
+
+def paste_rotated(result, image, angle, pivot, position, resample=Image.BICUBIC):
+    """
+    把图片绕 pivot 旋转后直接贴到 result 上，pivot 落在 position 处
+
+    只对旋转后落在 result 范围内的区域做一次仿射变换，
+    不需要先放进超大画布再整体旋转
+
+    参数:
+        result: 目标图片，RGBA格式，会被直接修改
+        image: 要旋转的图片，RGBA格式
+        angle: 旋转角度，方向与 Image.rotate 相同（正数为逆时针）
+        pivot: 旋转中心在 image 中的坐标，(x, y)格式
+        position: 旋转中心在 result 中的坐标，(x, y)格式
+        resample: 重采样方式
+
+    返回:
+        旋转后贴上去的图层（已裁剪到可见区域），完全不可见时返回 None
+    """
+    layer, layer_position = rotate_to_region(
+        image, angle, pivot, position, bounds=result.size, resample=resample
+    )
+    if layer is not None:
+        result.paste(layer, layer_position, layer)
+    return layer
+
+
 def draw_text_on_image(
     image, text, position, font_path, default_font_path, font_size, fill_color=(255, 255, 255, 255), 
     shadow_enabled=False, shadow_color=(0, 0, 0, 180), shadow_offset=(2, 2)
@@ -162,44 +324,53 @@ def draw_multiline_text_on_image(
     return img_copy, len(lines)
 
 
-def get_random_color(image_path):
+def _random_pixel_color(img, rng):
+    """读取图片中下部随机一点的颜色"""
+    # 获取图片尺寸
+    width, height = img.size
+
+    # 在图片范围内随机选择一个点
+    # 避免边缘区域，缩小范围到图片的20%-80%区域
+    random_x = rng.randint(int(width * 0.5), int(width * 0.8))
+    random_y = rng.randint(int(height * 0.5), int(height * 0.8))
+
+    # 获取随机点的颜色
+    if img.mode == "RGBA":
+        r, g, b, a = img.getpixel((random_x, random_y))
+        return (r, g, b, a)
+    elif img.mode == "RGB":
+        r, g, b = img.getpixel((random_x, random_y))
+        return (r + 100, g + 50, b, 255)
+    else:
+        r, g, b, a = img.convert("RGBA").getpixel((random_x, random_y))
+        return (r, g, b, a)
+
+
+def get_random_color(image_path, rng=None, images=None):
     """
     获取图片随机位置的颜色
 
     参数:
         image_path: 图片文件路径
+        rng: 随机数生成器，为 None 时使用 random 模块
+        images: ImageStore，为 None 时直接打开文件
 
     返回:
         随机点颜色，RGBA格式
     """
+    rng = rng or random
     try:
-        img = Image.open(image_path)
-        # 获取图片尺寸
-        width, height = img.size
-
-        # 在图片范围内随机选择一个点
-        # 避免边缘区域，缩小范围到图片的20%-80%区域
-        random_x = random.randint(int(width * 0.5), int(width * 0.8))
-        random_y = random.randint(int(height * 0.5), int(height * 0.8))
-
-        # 获取随机点的颜色
-        if img.mode == "RGBA":
-            r, g, b, a = img.getpixel((random_x, random_y))
-            return (r, g, b, a)
-        elif img.mode == "RGB":
-            r, g, b = img.getpixel((random_x, random_y))
-            return (r + 100, g + 50, b, 255)
-        else:
-            img = img.convert("RGBA")
-            r, g, b, a = img.getpixel((random_x, random_y))
-            return (r, g, b, a)
+        if images is not None:
+            return _random_pixel_color(images.get(image_path), rng)
+        with Image.open(image_path) as img:
+            return _random_pixel_color(img, rng)
     except Exception as e:
         logger.error(f"获取图片颜色时出错: {e}")
         # 返回随机颜色作为备选
         return (
-            random.randint(50, 200),
-            random.randint(50, 200),
-            random.randint(50, 200),
+            rng.randint(50, 200),
+            rng.randint(50, 200),
+            rng.randint(50, 200),
             255,
         )
 
@@ -229,20 +400,45 @@ def draw_color_block(image, position, size, color):
     return img_copy
 
 
-def create_gradient_background(width, height, name,color=None):
+@lru_cache(maxsize=8)
+def get_gradient_mask(width, height, exponent):
+    """
+    获取从左到右的渐变遮罩，同一尺寸和指数只生成一次
+
+    每一行的值都相同，只计算一行再纵向拉伸到完整高度。
+    返回的遮罩会被多次复用，调用方不能修改它
+
+    参数:
+        width: 遮罩宽度
+        height: 遮罩高度
+        exponent: 渐变指数，小于1时左侧深色区域更大
+
+    返回:
+        L模式的遮罩图像，左侧为0，右侧接近255
+    """
+    row = Image.new("L", (width, 1))
+    # 计算从左到右的渐变值 (0-255)
+    row.putdata([int(255.0 * (x / width) ** exponent) for x in range(width)])
+    return row.resize((width, height), Image.NEAREST)
+
+
+def create_gradient_background(server, width, height, name, color=None, rng=None):
     """
     创建一个从左到右的渐变背景，使用遮罩技术实现渐变效果
     左侧颜色更深，右侧颜色适中，提供更明显的渐变效果
     
     参数:
+        server: 服务器上下文，用于日志
         width: 背景宽度
         height: 背景高度
         color: 颜色数组或单个颜色，如果为None则随机生成
               如果是数组，会依次尝试每个颜色，跳过太黑或太淡的颜色
+        rng: 随机数生成器，为 None 时使用 random 模块
         
     返回:
         渐变背景图像
     """
+    rng = rng or random
     def normalize_rgb(input_rgb):
         """
         将各种可能的输入格式，统一提取成 (r, g, b) 三元组。
@@ -294,10 +490,10 @@ def create_gradient_background(width, height, name,color=None):
                     selected_color = color[i][0]
                 else:
                     selected_color = color[i]
-                logger.info(f"[{config.JELLYFIN_CONFIG['SERVER_NAME']}][{name}] 海报主题色:[{selected_color}]适合做背景")
+                logger.info(f"[{server['SERVER_NAME']}][{name}] 海报主题色:[{selected_color}]适合做背景")
                 break
             else:
-                logger.info(f"[{config.JELLYFIN_CONFIG['SERVER_NAME']}][{name}] 海报主题色:[{color[i]}]不适合做背景,尝试做下一个颜色")
+                logger.info(f"[{server['SERVER_NAME']}][{name}] 海报主题色:[{color[i]}]不适合做背景,尝试做下一个颜色")
     
     # 如果没有找到合适的颜色，随机生成一个颜色
     if selected_color is None:
@@ -313,9 +509,9 @@ def create_gradient_background(width, height, name,color=None):
             light_range: 明度范围，取值 0~1
             返回值：RGB 三元组，每个通道 0~255
             """
-            h = random.uniform(hue_range[0]/360.0, hue_range[1]/360.0)
-            s = random.uniform(sat_range[0], sat_range[1])
-            l = random.uniform(light_range[0], light_range[1])
+            h = rng.uniform(hue_range[0]/360.0, hue_range[1]/360.0)
+            s = rng.uniform(sat_range[0], sat_range[1])
+            l = rng.uniform(light_range[0], light_range[1])
             # colorsys.hls_to_rgb 接受 H, L, S (注意顺序) 都是 0~1
             r, g, b = colorsys.hls_to_rgb(h, l, s)
             # 转回 0~255
@@ -323,7 +519,7 @@ def create_gradient_background(width, height, name,color=None):
 
         # 生成颜色示例
         selected_color = random_hsl_to_rgb()
-        logger.info(f"[{config.JELLYFIN_CONFIG['SERVER_NAME']}][{name}] 海报所有主题色不适合做背景，随机生成一个颜色[{selected_color}]。")
+        logger.info(f"[{server['SERVER_NAME']}][{name}] 海报所有主题色不适合做背景，随机生成一个颜色[{selected_color}]。")
 
     # 如果是已经提供的颜色，将其加深
     # 降低各通道的亮度，使颜色更深
@@ -367,20 +563,8 @@ def create_gradient_background(width, height, name,color=None):
     left_image = Image.new("RGBA", (width, height), selected_color)
     right_image = Image.new("RGBA", (width, height), color2)
     
-    # 创建渐变遮罩（从黑到白的横向线性渐变）
-    mask = Image.new("L", (width, height), 0)
-    mask_data = []
-    
-    # 生成遮罩数据，使用更加平滑的过渡
-    for y in range(height):
-        for x in range(width):
-            # 计算从左到右的渐变值 (0-255)
-            # 使用更加非线性的渐变，使左侧深色区域更大
-            mask_value = int(255.0 * (x / width) ** 0.7)  # 从0.85改为0.7
-            mask_data.append(mask_value)
-    
-    # 应用遮罩数据到遮罩图像
-    mask.putdata(mask_data)
+    # 创建渐变遮罩（从黑到白的横向线性渐变），使左侧深色区域更大
+    mask = get_gradient_mask(width, height, 0.7)  # 从0.85改为0.7
     
     # 使用遮罩合成左右两个图像
     # 遮罩中黑色部分(0)显示left_image，白色部分(255)显示right_image
@@ -389,104 +573,162 @@ def create_gradient_background(width, height, name,color=None):
     return gradient
 
 
-def get_poster_primary_color(image_path):
+def get_poster_primary_color(image_path, colors=32, top_n=10, images=None):
     """
     分析图片并提取主色调
-    
+
+    先把图片量化为少量代表色，再按代表色统计像素数，
+    相近的颜色会合并计数，噪点较多的照片也能得到稳定的主色调
+
     参数:
         image_path: 图片文件路径
-        
+        colors: 量化后的颜色数量
+        top_n: 返回的候选颜色数量
+        images: ImageStore，为 None 时直接打开文件
+
     返回:
-        主色调颜色，RGBA格式
+        按出现次数从多到少排列的候选颜色列表，格式为 [((r, g, b, 255), 数量), ...]
     """
     try:
-        from collections import Counter
-        
-        # 打开图片
-        img = Image.open(image_path)
-        
-        # 缩小图片尺寸以加快处理速度
-        img = img.resize((100, 150), Image.LANCZOS)
-        
-        # 确保图片为RGBA模式
-        if img.mode != 'RGBA':
-            img = img.convert('RGBA')
-            
-        # 获取图片中心部分的像素数据（避免边框和角落）
-        # width, height = img.size
-        # center_x1 = int(width * 0.2)
-        # center_y1 = int(height * 0.2)
-        # center_x2 = int(width * 0.8)
-        # center_y2 = int(height * 0.8)
-        
-        # # 裁剪出中心区域
-        # center_img = img.crop((center_x1, center_y1, center_x2, center_y2))
+        if images is not None:
+            img = images.get(image_path).convert("RGBA").resize((100, 150), Image.LANCZOS)
+        else:
+            with Image.open(image_path) as img:
+                # JPEG 直接以较小尺寸解码，后面只需要 100x150
+                img.draft("RGB", (200, 300))
+                # 缩小图片尺寸以加快处理速度
+                img = img.convert("RGBA").resize((100, 150), Image.LANCZOS)
+
+        # 透明度低的像素不参与统计
+        alpha = img.getchannel("A")
+        opaque_mask = alpha.point(lambda a: 255 if a >= 200 else 0)
+        if not opaque_mask.getbbox():
+            opaque_mask = alpha.point(lambda a: 255 if a > 100 else 0)
+        if not opaque_mask.getbbox():
+            return [((150, 100, 50, 255), 0)]
+
+        # 量化为少量代表色，按代表色统计不透明像素的数量
+        quantized = img.convert("RGB").quantize(
+            colors=colors, method=Image.Quantize.FASTOCTREE
+        )
+        counts = quantized.histogram(mask=opaque_mask)
+        palette = quantized.getpalette()
 
-        # 获取所有像素
-        pixels = list(img.getdata())
-        
-        # 过滤掉接近黑色和白色的像素，以及透明度低的像素
-        filtered_pixels = []
-        for pixel in pixels:
-            r, g, b, a = pixel
-            
-            # 跳过透明度低的像素
-            if a < 200:
+        candidates = []
+        fallback = []
+        for index, count in enumerate(counts[:colors]):
+            if not count:
                 continue
-                
-            # 计算亮度
+            r, g, b = palette[index * 3:index * 3 + 3]
+            fallback.append(((r, g, b, 255), count))
+            # 跳过过暗或过亮的颜色
             brightness = (r + g + b) / 3
-            
-            # 跳过过暗或过亮的像素
-            if brightness < 30 or brightness > 220:
-                continue
-                
-            # 添加到过滤后的列表
-            filtered_pixels.append((r, g, b, 255))
-            
-        # 如果过滤后没有像素，使用全部像素
-        if not filtered_pixels:
-            filtered_pixels = [(p[0], p[1], p[2], 255) for p in pixels if p[3] > 100]
-            
-        # 如果仍然没有像素，返回默认颜色
-        if not filtered_pixels:
-            return (150, 100, 50, 255)
-            
-        # 使用Counter找到出现最多的颜色
-        color_counter = Counter(filtered_pixels)
-        common_colors = color_counter.most_common(10)
-        
-        # 如果找到了颜色，返回最常见的颜色
-        if common_colors:
-            return common_colors
-        
-        # 如果无法找到主色调，使用平均值
-        r_avg = sum(p[0] for p in filtered_pixels) // len(filtered_pixels)
-        g_avg = sum(p[1] for p in filtered_pixels) // len(filtered_pixels)
-        b_avg = sum(p[2] for p in filtered_pixels) // len(filtered_pixels)
-        
-        return [(r_avg, g_avg, b_avg, 255)]
-     
-        
+            if 30 <= brightness <= 220:
+                candidates.append(((r, g, b, 255), count))
+
+        # 如果过滤后没有颜色，使用全部颜色
+        if not candidates:
+            candidates = fallback
+
+        candidates.sort(key=lambda item: item[1], reverse=True)
+        return candidates[:top_n]
+
     except Exception as e:
         logger.error(f"获取图片主色调时出错: {e}")
         # 返回默认颜色作为备选
         return [(150, 100, 50, 255)]
 
-def gen_poster_workflow(name):
+
+def save_static_poster(
+    image, output_path, output_format="PNG", quality=90, effort=4, lossless=False, max_bytes=0
+):
+    """
+    按指定格式保存静态海报，超出大小预算时依次降低质量（PNG为减少颜色数）
+
+    参数:
+        image: 海报图片
+        output_path: 输出文件路径
+        output_format: 输出格式，PNG、JPEG、WEBP 或 AVIF
+        quality: 有损压缩质量（1-100）
+        effort: 压缩力度（0-6），越高越慢但文件越小
+        lossless: WebP是否使用无损压缩，JPEG和AVIF使用最高质量和不降采样的色度
+        max_bytes: 文件大小上限（字节），0表示不限制
+
+    返回:
+        (质量或颜色数, 文件大小, 编码次数)，为 None 表示无损或全彩
+    """
+    if output_format == "PNG":
+        levels = [None]
+        if max_bytes:
+            levels += [256, 128, 64, 32]
+    else:
+        # 质量从配置值开始每次降低10，无损压缩超出预算时改用有损压缩
+        qualities = list(range(quality, 24, -10)) or [quality]
+        levels = [None] if lossless else []
+        if max_bytes or not lossless:
+            levels += qualities if max_bytes else qualities[:1]
+        # 海报背景不透明，有损格式去掉alpha通道
+        image = image.convert("RGB")
+
+    def encode(level, fp):
+        if output_format == "PNG":
+            if level is None:
+                image.save(fp, format="PNG", compress_level=min(9, round(effort * 1.5)))
+            else:
+                # 转为调色板模式的PNG，文件通常只有全彩的几分之一
+                image.quantize(
+                    colors=level, method=Image.Quantize.FASTOCTREE, dither=Image.Dither.FLOYDSTEINBERG
+                ).save(fp, format="PNG", optimize=True)
+        elif output_format == "JPEG":
+            image.save(
+                fp,
+                format="JPEG",
+                quality=100 if level is None else level,
+                subsampling=0 if level is None else 2,
+                optimize=effort >= 4,
+            )
+        elif output_format == "WEBP":
+            if level is None:
+                image.save(fp, format="WEBP", lossless=True, method=effort)
+            else:
+                image.save(fp, format="WEBP", quality=level, method=effort)
+        else:
+            image.save(
+                fp,
+                format="AVIF",
+                quality=100 if level is None else level,
+                subsampling="4:4:4" if level is None else "4:2:0",
+                speed=max(0, 10 - effort),
+            )
+
+    return fit_to_budget(encode, levels, max_bytes, output_path)
+
+
+def gen_poster_workflow(server, name):
     """
     将多张电影海报排列成三列，每列三张，然后将每列作为整体旋转并放在渐变背景上
     不再依赖外部模板文件，直接生成渐变背景
+
+    参数:
+        server: 服务器上下文
+        name: 媒体库名称
     """
 
+    # 每张海报只解码一次，主色调提取至少需要 200x300
+    images = ImageStore(
+        (
+            max(config.POSTER_GEN_CONFIG["CELL_WIDTH"], 200),
+            max(config.POSTER_GEN_CONFIG["CELL_HEIGHT"], 300),
+        )
+    )
     try:
         logger.info(
-            f"[{config.JELLYFIN_CONFIG['SERVER_NAME']}][{name}] [3/4] 正在生成海报..."
+            f"[{server['SERVER_NAME']}][{name}] [3/4] 正在生成海报..."
         )
         logger.info("-" * 40)
-        poster_folder = os.path.join(config.POSTER_FOLDER, name)
+        poster_folder = os.path.join(server["POSTER_DIR"], name)
         first_image_path = os.path.join(poster_folder, "1.jpg")
-        output_path = os.path.join(config.OUTPUT_FOLDER, f"{name}.png")
+        output_path, _ = config.get_output_file(server, name, animated=False)
         rows = config.POSTER_GEN_CONFIG["ROWS"]
         cols = config.POSTER_GEN_CONFIG["COLS"]
         margin = config.POSTER_GEN_CONFIG["MARGIN"]
@@ -498,12 +740,8 @@ def gen_poster_workflow(name):
         save_columns = config.POSTER_GEN_CONFIG["SAVE_COLUMNS"]
 
         # 定义模板尺寸（可以根据需要调整）
-        template_width = 1920  # 或者从配置中获取
-        template_height = 1080  # 或者从配置中获取
-        color=  get_poster_primary_color(first_image_path)
-        # 创建渐变背景作为模板
-        gradient_bg = create_gradient_background(template_width, template_height, name, color)
-
+        template_width = config.POSTER_GEN_CONFIG["TEMPLATE_WIDTH"]
+        template_height = config.POSTER_GEN_CONFIG["TEMPLATE_HEIGHT"]
 
         # 创建保存中间文件的文件夹
         output_dir = os.path.dirname(output_path)
@@ -537,10 +775,28 @@ def gen_poster_workflow(name):
         # 确保至少有一张图片
         if not poster_files:
             logger.error(
-                f"[{config.JELLYFIN_CONFIG['SERVER_NAME']}][{name}] 错误: 在 {poster_folder} 中没有找到支持的图片文件"
+                f"[{server['SERVER_NAME']}][{name}] 错误: 在 {poster_folder} 中没有找到支持的图片文件"
             )
             return False
 
+        # 渲染输入与之前某次完全相同时，直接使用缓存的海报
+        render_key = render_cache.compute_render_key(
+            name, [first_image_path] + poster_files, animated=False
+        )
+        if render_cache.restore(render_key, output_path):
+            logger.info(
+                f"[{server['SERVER_NAME']}][{name}] 渲染输入未变化（{render_key[:12]}），使用缓存的海报: {output_path}"
+            )
+            return True
+        # 随机选择的颜色由渲染输入决定，相同输入总是生成相同的海报
+        rng = render_cache.create_rng(render_key)
+
+        color = get_poster_primary_color(first_image_path, images=images)
+        # 创建渐变背景作为模板
+        gradient_bg = create_gradient_background(
+            server, template_width, template_height, name, color, rng=rng
+        )
+
         # 限制最多处理 rows*cols 张图片
         max_posters = rows * cols
         poster_files = poster_files[:max_posters]
@@ -581,47 +837,19 @@ def gen_poster_workflow(name):
             # 在列画布上放置每张图片
             for row_index, poster_path in enumerate(column_posters):
                 try:
-                    # 打开海报
-                    poster = Image.open(poster_path)
-
-                    # 调整海报大小为固定尺寸
-                    resized_poster = poster.resize(
-                        (cell_width, cell_height), Image.LANCZOS
-                    )
-
-                    # 创建圆角遮罩（如果需要）
-                    if corner_radius > 0:
-                        # 创建一个透明的遮罩
-                        mask = Image.new("L", (cell_width, cell_height), 0)
-
-                        # 绘制圆角
-                        from PIL import ImageDraw
-
-                        draw = ImageDraw.Draw(mask)
-                        draw.rounded_rectangle(
-                            [(0, 0), (cell_width, cell_height)],
-                            radius=corner_radius,
-                            fill=255,
-                        )
-
-                        # 应用遮罩
-                        poster_with_corners = Image.new(
-                            "RGBA", resized_poster.size, (0, 0, 0, 0)
-                        )
-                        poster_with_corners.paste(resized_poster, (0, 0), mask)
-                        resized_poster = poster_with_corners
-
-                    # 添加阴影效果到每张海报
-                    resized_poster_with_shadow = add_shadow(
-                        resized_poster,
-                        offset=(20, 20),  # 较大的偏移量
-                        shadow_color=(
-                            0,
-                            0,
-                            0,
-                            255,
-                        ),  # 更深的黑色，但不要超过255的透明度
-                        blur_radius=20,  # 保持模糊半径
+                    # 调整海报大小并添加圆角和阴影
+                    resized_poster_with_shadow = images.get_cell(
+                        poster_path,
+                        (cell_width, cell_height, corner_radius, (20, 20), (0, 0, 0, 255), 20),
+                        lambda poster: create_poster_cell(
+                            poster,
+                            cell_width,
+                            cell_height,
+                            corner_radius,
+                            shadow_offset=(20, 20),  # 较大的偏移量
+                            shadow_color=(0, 0, 0, 255),  # 更深的黑色，但不要超过255的透明度
+                            blur_radius=20,  # 保持模糊半径
+                        ),
                     )
 
                     # 计算在列画布上的位置（垂直排列）
@@ -637,7 +865,7 @@ def gen_poster_workflow(name):
 
                 except Exception as e:
                     logger.error(
-                        f"[{config.JELLYFIN_CONFIG['SERVER_NAME']}][{name}] 处理图片 {os.path.basename(poster_path)} 时出错: {e}"
+                        f"[{server['SERVER_NAME']}][{name}] 处理图片 {os.path.basename(poster_path)} 时出错: {e}"
                     )
                     continue
 
@@ -648,40 +876,7 @@ def gen_poster_workflow(name):
                 )
                 column_image.save(column_orig_path)
                 logger.debug(
-                    f"[{config.JELLYFIN_CONFIG['SERVER_NAME']}][{name}] 已保存原始列图像到: {column_orig_path}"
-                )
-
-            # 现在我们有了完整的一列图片，准备旋转它
-            # 创建一个足够大的画布来容纳旋转后的列
-            rotation_canvas_size = int(
-                math.sqrt(
-                    (cell_width + shadow_extra_width) ** 2
-                    + (column_height + shadow_extra_height) ** 2
-                )
-                * 1.5
-            )
-            rotation_canvas = Image.new(
-                "RGBA", (rotation_canvas_size, rotation_canvas_size), (0, 0, 0, 0)
-            )
-
-            # 将列图片放在旋转画布的中央
-            paste_x = (rotation_canvas_size - cell_width) // 2
-            paste_y = (rotation_canvas_size - column_height) // 2
-            rotation_canvas.paste(column_image, (paste_x, paste_y), column_image)
-
-            # 旋转整个列
-            rotated_column = rotation_canvas.rotate(
-                rotation_angle, Image.BICUBIC, expand=True
-            )
-
-            # 保存旋转后的列图像
-            if save_columns:
-                column_rotated_path = os.path.join(
-                    columns_dir, f"column_{col_index+1}_rotated.png"
-                )
-                rotated_column.save(column_rotated_path)
-                logger.debug(
-                    f"[{config.JELLYFIN_CONFIG['SERVER_NAME']}][{name}] 已保存旋转后的列图像到: {column_rotated_path}"
+                    f"[{server['SERVER_NAME']}][{name}] 已保存原始列图像到: {column_orig_path}"
                 )
 
             # 计算列在模板上的位置（不同的列有不同的y起点）
@@ -695,23 +890,39 @@ def gen_poster_workflow(name):
                 column_center_y += -155
                 column_center_x += (cell_width) * 2 - 40
 
-            # 计算最终放置位置
-            final_x = column_center_x - rotated_column.width // 2 + cell_width // 2
-            final_y = column_center_y - rotated_column.height // 2
+            # 按自身透明度贴到透明画布上，阴影深浅与原来放入旋转画布后的效果一致
+            faded_column = Image.new("RGBA", column_image.size, (0, 0, 0, 0))
+            faded_column.paste(column_image, (0, 0), column_image)
 
-            # 粘贴旋转后的列到结果图像
-            result.paste(rotated_column, (final_x, final_y), rotated_column)
+            # 以海报区域中心为旋转中心，旋转后直接贴到结果图像的可见区域
+            rotated_column = paste_rotated(
+                result,
+                faded_column,
+                rotation_angle,
+                (cell_width / 2, column_height / 2),
+                (column_center_x + cell_width / 2, column_center_y),
+            )
+
+            # 保存旋转后的列图像（只包含可见部分）
+            if save_columns and rotated_column is not None:
+                column_rotated_path = os.path.join(
+                    columns_dir, f"column_{col_index+1}_rotated.png"
+                )
+                rotated_column.save(column_rotated_path)
+                logger.debug(
+                    f"[{server['SERVER_NAME']}][{name}] 已保存旋转后的列图像到: {column_rotated_path}"
+                )
 
         # 获取第一张图片的随机点颜色
         if poster_files:
             first_image_path = poster_files[0]
-            random_color = get_random_color(first_image_path)
+            random_color = get_random_color(first_image_path, rng, images=images)
         else:
             # 如果没有图片，生成一个随机颜色
             random_color = (
-                random.randint(50, 200),
-                random.randint(50, 200),
-                random.randint(50, 200),
+                rng.randint(50, 200),
+                rng.randint(50, 200),
+                rng.randint(50, 200),
                 255,
             )
 
@@ -778,10 +989,10 @@ def gen_poster_workflow(name):
 
             # 打印调试信息
             logger.debug(
-                f"[{config.JELLYFIN_CONFIG['SERVER_NAME']}][{name}] 英文名 '{library_eng_name}' 单词数量: {word_count}, 最长单词长度: {max_chars_per_line}"
+                f"[{server['SERVER_NAME']}][{name}] 英文名 '{library_eng_name}' 单词数量: {word_count}, 最长单词长度: {max_chars_per_line}"
             )
             logger.debug(
-                f"[{config.JELLYFIN_CONFIG['SERVER_NAME']}][{name}] 使用字体大小: {font_size:.2f}"
+                f"[{server['SERVER_NAME']}][{name}] 使用字体大小: {font_size:.2f}"
             )
 
             # 使用多行文本绘制，可选添加阴影
@@ -804,25 +1015,52 @@ def gen_poster_workflow(name):
             color_block_size = (21.51, color_block_height)
 
             logger.debug(
-                f"[{config.JELLYFIN_CONFIG['SERVER_NAME']}][{name}] 色块高度调整为: {color_block_height} (行数: {line_count})"
+                f"[{server['SERVER_NAME']}][{name}] 色块高度调整为: {color_block_height} (行数: {line_count})"
             )
 
             result = draw_color_block(
                 result, color_block_position, color_block_size, random_color
             )
         # 保存结果
-        result.save(output_path)
+        output_format = config.get_output_format(animated=False)
+        max_bytes = config.STATIC_CONFIG["MAX_BYTES"]
+        encode_start = time.perf_counter()
+        level, size, attempts = save_static_poster(
+            result,
+            output_path,
+            output_format,
+            quality=config.STATIC_CONFIG["QUALITY"],
+            effort=config.STATIC_CONFIG["EFFORT"],
+            lossless=config.STATIC_CONFIG["LOSSLESS"],
+            max_bytes=max_bytes,
+        )
+        if output_format == "PNG":
+            setting = f"颜色数 {level or '全彩'}"
+        else:
+            setting = f"质量 {level or '无损'}"
+        logger.info(
+            f"[{server['SERVER_NAME']}][{name}] 编码完成: {output_format} {size / 1024:.1f} KB，"
+            f"用时 {time.perf_counter() - encode_start:.2f} 秒，{setting}，编码 {attempts} 次"
+        )
+        if max_bytes and size > max_bytes:
+            logger.warning(
+                f"[{server['SERVER_NAME']}][{name}] 最低质量下仍超出大小预算 {max_bytes / 1024:.1f} KB"
+            )
+        render_cache.store(render_key, output_path)
         logger.info(
-            f"[{config.JELLYFIN_CONFIG['SERVER_NAME']}][{name}] 成功: 图片已保存到 {output_path}"
+            f"[{server['SERVER_NAME']}][{name}] 成功: 图片已保存到 {output_path}"
         )
         return True
 
     except Exception as e:
         logger.error(
-            f"[{config.JELLYFIN_CONFIG['SERVER_NAME']}][{name}] 创建九宫格图片时出错: {e}",
+            f"[{server['SERVER_NAME']}][{name}] 创建九宫格图片时出错: {e}",
             exc_info=True,
         )
         return False
+    finally:
+        # 媒体库处理完成，释放所有解码的海报
+        images.close()
 
 
 if __name__ == "__main__":
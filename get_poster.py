@@ -2,36 +2,42 @@ import os
 import requests
 import json
 import random
+import shutil
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import config
+import artwork_cache
+import library_state
+from http_session import get_session
 from logger import get_module_logger
 
 # 获取模块日志记录器
 logger = get_module_logger("get_poster")
 
 
-def ensure_poster_directory(poster_dir, name):
-    """确保海报文件夹存在，如果不存在则创建"""
-    full_path = os.path.join(poster_dir, name)
+def ensure_poster_directory(server, name):
+    """确保服务器下的海报文件夹存在，如果不存在则创建"""
+    full_path = os.path.join(server["POSTER_DIR"], name)
     if not os.path.exists(full_path):
         os.makedirs(full_path)
         logger.info(
-            f"[{config.JELLYFIN_CONFIG['SERVER_NAME']}][{name}] 创建海报文件夹: {full_path}"
+            f"[{server['SERVER_NAME']}][{name}] 创建海报文件夹: {full_path}"
         )
     else:
         # 清空文件夹中的旧文件
         for file_name in os.listdir(full_path):
-            if file_name.endswith((".jpg", ".jpeg", ".png")):
+            if file_name.endswith((".jpg", ".jpeg", ".png", ".tmp")):
                 os.remove(os.path.join(full_path, file_name))
         logger.info(
-            f"[{config.JELLYFIN_CONFIG['SERVER_NAME']}][{name}] 清空海报文件夹中的旧文件"
+            f"[{server['SERVER_NAME']}][{name}] 清空海报文件夹中的旧文件"
         )
     return full_path
 
 
-def get_items(parent_id, library_name=None):
-    """获取媒体项列表"""
+def build_items_url(server, parent_id, library_name=None):
+    """按媒体库配置的排序方式构造获取媒体项列表的URL"""
     # 根据库名从TEMPLATE_MAPPING中获取排序方式
     sort_by = "DateCreated"  # 默认排序方式
 
@@ -50,23 +56,37 @@ def get_items(parent_id, library_name=None):
 
                 break
     logger.info(
-        f"[{config.JELLYFIN_CONFIG['SERVER_NAME']}][{library_name}] 使用配置的排序方式: {sort_by}"
+        f"[{server['SERVER_NAME']}][{library_name}] 使用配置的排序方式: {sort_by}"
     )
     # 修改为获取用户的媒体库列表，添加Limit参数限制返回数量以避免timeout
     # 使用50作为限制，因为只需要9张海报，50个项目足够过滤和选择
-    url = f"{config.JELLYFIN_CONFIG['BASE_URL']}/Users/{config.JELLYFIN_CONFIG['USER_ID']}/Items/?ParentId={parent_id}&Recursive=true&SortBy={sort_by}&SortOrder=Descending&IncludeItemTypes=Movie,Series,Audio,Music,Game,Book,MusicVideo,BoxSet&Limit=50"
+    return f"{server['BASE_URL']}/Users/{server['USER_ID']}/Items/?ParentId={parent_id}&Recursive=true&SortBy={sort_by}&SortOrder=Descending&IncludeItemTypes=Movie,Series,Audio,Music,Game,Book,MusicVideo,BoxSet&Limit=50"
+
+
+def get_items(server, parent_id, library_name=None):
+    """获取媒体项列表"""
+    if config.ASYNC_NETWORK:
+        # 异步网络模式：请求在共享的事件循环中执行
+        import async_client
+        return async_client.run(
+            async_client.get_client(server).get_items(server, parent_id, library_name)
+        )
+
+    url = build_items_url(server, parent_id, library_name)
     print(f"{url}")
 
     headers = {
-        "Authorization": f'MediaBrowser Token="{config.JELLYFIN_CONFIG["ACCESS_TOKEN"]}"'
+        "Authorization": f'MediaBrowser Token="{server["ACCESS_TOKEN"]}"'
     }
     try:
-        log_prefix = f"[{config.JELLYFIN_CONFIG['SERVER_NAME']}]"
+        log_prefix = f"[{server['SERVER_NAME']}]"
         if library_name:
             log_prefix += f"[{library_name}]"
 
         logger.info(f"{log_prefix} 正在从 Jellyfin 获取媒体列表...")
-        response = requests.get(url, headers=headers, timeout=30)
+        response = get_session(server).get(
+            url, headers=headers, timeout=config.HTTP_CONFIG["TIMEOUT"]
+        )
 
         if response.status_code == 200:
             data = response.json()
@@ -86,21 +106,21 @@ def get_items(parent_id, library_name=None):
     except Exception as e:
         if library_name:
             logger.error(
-                f"[{config.JELLYFIN_CONFIG['SERVER_NAME']}][{library_name}] 获取媒体列表时出错: {e}"
+                f"[{server['SERVER_NAME']}][{library_name}] 获取媒体列表时出错: {e}"
             )
         else:
             logger.error(
-                f"[{config.JELLYFIN_CONFIG['SERVER_NAME']}] 获取媒体列表时出错: {e}"
+                f"[{server['SERVER_NAME']}] 获取媒体列表时出错: {e}"
             )
         return []
 
 
-def sort_and_select_items(items, count=9, library_name=None):
+def sort_and_select_items(server, items, count=9, library_name=None):
     """根据日期排序并选择特定数量的媒体项，剔除没有封面图片的项目"""
     if not items:
         return []
 
-    log_prefix = f"[{config.JELLYFIN_CONFIG['SERVER_NAME']}]"
+    log_prefix = f"[{server['SERVER_NAME']}]"
     if library_name:
         log_prefix += f"[{library_name}]"
 
@@ -127,160 +147,258 @@ def sort_and_select_items(items, count=9, library_name=None):
     return selected_items
 
 
-def download_image(item_id, output_path, index, library_name=None):
-    """下载指定 ID 的媒体项的封面图片"""
-    url = f"{config.JELLYFIN_CONFIG['BASE_URL']}/Items/{item_id}/Images/{config.JELLYFIN_CONFIG['IMAGE_TYPE']}"
+def get_image_request_params():
+    """
+    根据渲染尺寸计算服务器端缩放和重新编码参数
+
+    返回:
+        dict: 图片请求参数，未启用服务器端缩放时返回空字典
+    """
+    if not config.DOWNLOAD_CONFIG["SERVER_RESIZE"]:
+        return {}
+    cell_width, cell_height = config.get_render_cell_size()
+    return {
+        "maxWidth": cell_width,
+        "maxHeight": cell_height,
+        "quality": config.DOWNLOAD_CONFIG["QUALITY"],
+        "format": config.DOWNLOAD_CONFIG["FORMAT"],
+    }
+
+
+def download_image(server, item_id, output_path, index, library_name=None, params=None):
+    """下载指定 ID 的媒体项的封面图片，params 为服务器端缩放参数"""
+    url = f"{server['BASE_URL']}/Items/{item_id}/Images/{server['IMAGE_TYPE']}"
 
     headers = {
-        "Authorization": f'MediaBrowser Token="{config.JELLYFIN_CONFIG["ACCESS_TOKEN"]}"'
+        "Authorization": f'MediaBrowser Token="{server["ACCESS_TOKEN"]}"'
     }
 
-    log_prefix = f"[{config.JELLYFIN_CONFIG['SERVER_NAME']}]"
+    log_prefix = f"[{server['SERVER_NAME']}]"
     if library_name:
         log_prefix += f"[{library_name}]"
 
     try:
-        response = requests.get(url, headers=headers, stream=True, timeout=30)
-
-        if response.status_code == 200:
-            # 保存图片
-            with open(output_path, "wb") as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
-            # logger.debug(f"{log_prefix} 图片 {index} 已保存到: {output_path}")
-            return True
-        else:
-            logger.warning(
-                f"{log_prefix} 下载图片 {index} 失败，状态码: {response.status_code}"
-            )
-            return False
+        # 使用with确保响应关闭，连接能够归还到连接池
+        with get_session(server).get(
+            url,
+            headers=headers,
+            params=params,
+            stream=True,
+            timeout=config.HTTP_CONFIG["TIMEOUT"],
+        ) as response:
+            if response.status_code == 200:
+                # 保存图片
+                with open(output_path, "wb") as f:
+                    for chunk in response.iter_content(chunk_size=8192):
+                        if chunk:
+                            f.write(chunk)
+                # logger.debug(f"{log_prefix} 图片 {index} 已保存到: {output_path}")
+                return True
+            else:
+                logger.warning(
+                    f"{log_prefix} 下载图片 {index} 失败，状态码: {response.status_code}"
+                )
+                return False
     except Exception as e:
         logger.error(f"{log_prefix} 下载图片 {index} 时出错: {e}")
         return False
 
 
-def download_all_posters(selected_items, full_path, library_name, target_count=None):
-    """下载所有选定的海报，如果不足目标数量则重复下载
-    
+def get_artwork_cache_path(server, item, params):
+    """媒体项封面在本地缓存中的路径，未启用缓存或没有图片标签时返回None"""
+    if not config.CACHE_CONFIG["ARTWORK_CACHE"]:
+        return None
+    # 缩放参数不同得到的图片也不同，需要作为缓存键的一部分
+    return artwork_cache.get_cache_path(
+        server["BASE_URL"],
+        item["Id"],
+        item.get("ImageTags", {}).get(server["IMAGE_TYPE"]),
+        artwork_cache.get_variant(params),
+    )
+
+
+def fetch_poster(server, item, output_path, index, library_name=None):
+    """
+    获取媒体项的封面图片，优先使用本地缓存，只有图片标签变化时才重新下载
+
+    返回:
+        tuple: (是否成功, 是否命中缓存)
+    """
+    params = get_image_request_params()
+    cache_path = get_artwork_cache_path(server, item, params)
+    if cache_path is None:
+        return download_image(server, item["Id"], output_path, index, library_name, params), False
+
+    if artwork_cache.lookup(cache_path):
+        shutil.copyfile(cache_path, output_path)
+        return True, True
+
+    # 先下载到临时文件，完整下载后再放入缓存，避免中断时留下损坏的缓存
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    temp_cache_path = f"{cache_path}.{threading.get_ident()}.tmp"
+    if not download_image(server, item["Id"], temp_cache_path, index, library_name, params):
+        if os.path.exists(temp_cache_path):
+            os.remove(temp_cache_path)
+        return False, False
+    os.replace(temp_cache_path, cache_path)
+    shutil.copyfile(cache_path, output_path)
+    return True, False
+
+
+def download_all_posters(server, selected_items, full_path, library_name, target_count=None):
+    """并发下载所有选定的海报（图片未变化时直接使用缓存），如果不足目标数量则复制已下载的图片补足
+
     参数:
+        server: 服务器上下文
         selected_items: 选定的媒体项列表
         full_path: 保存路径
         library_name: 媒体库名称
         target_count: 目标下载数量，如果为None则使用默认配置
     """
-    success_count = 0
     if target_count is None:
         target_count = config.POSTER_DOWNLOAD_CONFIG["POSTER_COUNT"]
-    downloaded_items = []
 
-    # 首先尝试下载所有可用的海报
+    # 检查 ID 是否存在，只保留前 target_count 个有效项目
+    candidates = []
     for index, item in enumerate(selected_items, 1):
-        # 检查 ID 是否存在
         if "Id" not in item:
             logger.warning(
-                f"[{config.JELLYFIN_CONFIG['SERVER_NAME']}][{library_name}] 跳过第 {index} 个项目: 缺少 ID"
+                f"[{server['SERVER_NAME']}][{library_name}] 跳过第 {index} 个项目: 缺少 ID"
             )
             continue
+        candidates.append(item)
+        if len(candidates) >= target_count:
+            break
 
-        # 由于已经在sort_and_select_items中过滤，这里不再需要检查是否有Primary图片
-        item_id = item["Id"]
-        output_path = os.path.join(full_path, f"{success_count + 1}.jpg")
-
-        if download_image(item_id, output_path, success_count + 1, library_name):
-            success_count += 1
-            downloaded_items.append(item)
+    if not candidates:
+        return 0
+
+    # 先并发下载到临时文件，全部完成后再按原顺序重命名为 1.jpg、2.jpg...
+    workers = max(1, min(server.get("DOWNLOAD_WORKERS", 4), len(candidates)))
+    temp_paths = [
+        os.path.join(full_path, f".download_{index}.tmp")
+        for index in range(1, len(candidates) + 1)
+    ]
+    if config.ASYNC_NETWORK:
+        # 异步网络模式：所有下载在共享的事件循环中同时进行，不占用线程
+        import async_client
+        results = async_client.run(
+            async_client.fetch_posters(server, candidates, temp_paths, library_name)
+        )
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(fetch_poster, server, item, temp_path, index, library_name)
+                for index, (item, temp_path) in enumerate(zip(candidates, temp_paths), 1)
+            ]
+            results = [future.result() for future in futures]
+
+    cache_hits = sum(1 for ok, hit in results if ok and hit)
+    if cache_hits:
+        logger.info(
+            f"[{server['SERVER_NAME']}][{library_name}] 命中海报缓存 {cache_hits}/{len(candidates)} 张，跳过下载"
+        )
 
-        # 如果已经达到目标数量，退出循环
-        if success_count >= target_count:
-            break
+    success_count = 0
+    downloaded_paths = []
+    for (ok, _), temp_path in zip(results, temp_paths):
+        if not ok:
+            # 删除下载失败时可能残留的半截文件
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            continue
+        success_count += 1
+        output_path = os.path.join(full_path, f"{success_count}.jpg")
+        os.replace(temp_path, output_path)
+        downloaded_paths.append(output_path)
 
-    # 如果下载的图片数量不足目标数量，则重复下载已有的图片
+    # 如果下载的图片数量不足目标数量，则循环复制已下载的图片，不再重复请求服务器
     if success_count > 0 and success_count < target_count:
         logger.info(
-            f"[{config.JELLYFIN_CONFIG['SERVER_NAME']}][{library_name}] 下载的图片数量({success_count})不足{target_count}张，将重复下载已有图片"
+            f"[{server['SERVER_NAME']}][{library_name}] 下载的图片数量({success_count})不足{target_count}张，将重复使用已有图片"
         )
 
-        # 循环重复下载已有图片，直到达到目标数量
         repeat_index = 0
         while success_count < target_count:
-            # 获取一个已下载项目（循环使用）
-            repeat_item = downloaded_items[repeat_index % len(downloaded_items)]
+            source_path = downloaded_paths[repeat_index % len(downloaded_paths)]
             repeat_index += 1
-
-            item_id = repeat_item["Id"]
-            output_path = os.path.join(full_path, f"{success_count + 1}.jpg")
-
-            if download_image(item_id, output_path, success_count + 1, library_name):
-                success_count += 1
+            success_count += 1
+            shutil.copyfile(source_path, os.path.join(full_path, f"{success_count}.jpg"))
 
     return success_count
 
 
-def download_posters_workflow(parent_id, name):
+def download_posters_workflow(server, parent_id, name):
     """
     封装整个下载海报的工作流程，供main.py调用
 
+    参数:
+        server: 服务器上下文
+        parent_id: 媒体库ID
+        name: 媒体库名称
+
     返回:
-        tuple: (成功标志, 下载的海报数量, 配置信息)
+        tuple: (成功标志, 下载的海报数量, 媒体库指纹)
     """
     try:
         logger.info(
-            f"[{config.JELLYFIN_CONFIG['SERVER_NAME']}][{name}] [2/4] 下载海报..."
+            f"[{server['SERVER_NAME']}][{name}] [2/4] 下载海报..."
         )
         logger.info("-" * 40)
 
         # 确保海报文件夹存在
-        full_path = ensure_poster_directory(config.POSTER_FOLDER, name)
+        full_path = ensure_poster_directory(server, name)
 
         # 获取媒体项列表
-        items = get_items(parent_id, name)
+        items = get_items(server, parent_id, name)
         if not items:
             logger.warning(
-                f"[{config.JELLYFIN_CONFIG['SERVER_NAME']}][{name}] 没有可用的媒体封面"
+                f"[{server['SERVER_NAME']}][{name}] 没有可用的媒体封面"
             )
-            return False, 0
+            return False, 0, None
 
             # 根据动画配置决定下载数量
         if config.ANIMATION_CONFIG.get("ENABLED", False):
             poster_count = config.ANIMATION_CONFIG.get("POSTER_COUNT", 9)
             logger.info(
-                f"[{config.JELLYFIN_CONFIG['SERVER_NAME']}][{name}] 动画模式启用，下载 {poster_count} 张海报"
+                f"[{server['SERVER_NAME']}][{name}] 动画模式启用，下载 {poster_count} 张海报"
             )
         else:
             poster_count = config.POSTER_DOWNLOAD_CONFIG["POSTER_COUNT"]
 
         # 排序并选择媒体项
         selected_items = sort_and_select_items(
-            items, poster_count, name
+            server, items, poster_count, name
         )
         if not selected_items:
             logger.warning(
-                f"[{config.JELLYFIN_CONFIG['SERVER_NAME']}][{name}] 没有可用的媒体封面"
+                f"[{server['SERVER_NAME']}][{name}] 没有可用的媒体封面"
             )
-            return False, 0
+            return False, 0, None
 
         # 下载所有海报
-        success_count = download_all_posters(selected_items, full_path, name, poster_count)
+        success_count = download_all_posters(server, selected_items, full_path, name, poster_count)
 
         # 输出结果
         if success_count > 0:
             logger.info(
-                f"[{config.JELLYFIN_CONFIG['SERVER_NAME']}][{name}] 成功下载 {success_count}/{poster_count} 张海报"
+                f"[{server['SERVER_NAME']}][{name}] 成功下载 {success_count}/{poster_count} 张海报"
             )
             logger.info(
-                f"[{config.JELLYFIN_CONFIG['SERVER_NAME']}][{name}] 海报已保存到: {full_path}"
+                f"[{server['SERVER_NAME']}][{name}] 海报已保存到: {full_path}"
+            )
+            return True, success_count, library_state.compute_fingerprint(
+                server, selected_items, name
             )
-            return True, success_count
         else:
             logger.error(
-                f"[{config.JELLYFIN_CONFIG['SERVER_NAME']}][{name}] 所有海报下载失败，程序终止"
+                f"[{server['SERVER_NAME']}][{name}] 所有海报下载失败，程序终止"
             )
-            return False, 0
+            return False, 0, None
 
     except Exception as e:
         logger.error(
-            f"[{config.JELLYFIN_CONFIG['SERVER_NAME']}][{name}] 下载海报时出错: {e}",
+            f"[{server['SERVER_NAME']}][{name}] 下载海报时出错: {e}",
             exc_info=True,
         )
-        return False, 0
+        return False, 0, None
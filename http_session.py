@@ -0,0 +1,89 @@
+"""
+HTTP会话模块
+为每个Jellyfin/Emby服务器维护一个带连接池的requests.Session，
+同一服务器的所有请求复用TCP/TLS连接，避免每次请求都重新握手
+"""
+
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import config
+from logger import get_module_logger
+
+# 获取模块日志记录器
+logger = get_module_logger("http_session")
+
+# 按服务器地址缓存的会话
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def _create_session(base_url, pool_maxsize):
+    """创建一个带连接池、自动重试和默认请求头的会话"""
+    session = requests.Session()
+
+    # 只对幂等请求重试，上传(POST)失败由调用方处理
+    retry = Retry(
+        total=config.HTTP_CONFIG["RETRIES"],
+        connect=config.HTTP_CONFIG["RETRIES"],
+        read=config.HTTP_CONFIG["RETRIES"],
+        backoff_factor=config.HTTP_CONFIG["BACKOFF_FACTOR"],
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset(["GET", "HEAD"]),
+        raise_on_status=False,
+    )
+    # 每个会话只连接一个服务器，所以只需要一个连接池，池大小决定最大并发连接数
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=pool_maxsize,
+        max_retries=retry,
+        pool_block=True,
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    session.headers.update(
+        {
+            "User-Agent": config.HTTP_CONFIG["USER_AGENT"],
+            "Accept-Encoding": "gzip, deflate",
+            "Connection": "keep-alive",
+        }
+    )
+    logger.debug(f"为服务器 {base_url} 创建HTTP会话，连接池大小: {pool_maxsize}")
+    return session
+
+
+def get_session(server):
+    """
+    获取指定服务器的共享会话，不存在则创建
+
+    参数:
+        server: 服务器上下文
+
+    返回:
+        requests.Session: 该服务器的会话
+    """
+    base_url = server["BASE_URL"].rstrip("/")
+
+    with _sessions_lock:
+        session = _sessions.get(base_url)
+        if session is None:
+            # 连接池至少要容纳所有下载线程，再额外留出获取列表和上传用的连接
+            pool_maxsize = max(
+                config.HTTP_CONFIG["POOL_MAXSIZE"],
+                server.get("DOWNLOAD_WORKERS", 4) + 2,
+            )
+            session = _create_session(base_url, pool_maxsize)
+            _sessions[base_url] = session
+        return session
+
+
+def close_all_sessions():
+    """关闭所有会话，释放空闲连接（每轮任务结束后调用）"""
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
@@ -0,0 +1,116 @@
+"""
+海报图片存储模块
+生成一个媒体库的海报期间，每张海报只打开和解码一次，
+主色调提取、随机取色和排版都使用同一份解码结果，媒体库处理完成时统一释放。
+处理好的单元格保存在磁盘缓存中，命中时直接内存映射，不需要解码海报
+"""
+
+from PIL import Image
+
+import cell_cache
+import config
+from logger import get_module_logger
+from render_cache import file_digest
+
+# 获取模块日志记录器
+logger = get_module_logger("image_store")
+
+
+class ImageStore:
+    """
+    按文件路径保存解码后的海报图片
+
+    JPEG 使用 draft 模式直接按缩小的比例解码，解码结果不小于 draft_size。
+    文件读取完成后立即关闭，不会一直占用文件句柄。
+    可以用作上下文管理器，退出时释放所有图片
+    """
+
+    def __init__(self, draft_size=None):
+        """
+        参数:
+            draft_size: 使用者需要的最小尺寸 (宽, 高)，为 None 时按原始尺寸解码
+        """
+        self.draft_size = draft_size
+        self._images = {}
+        self._cells = {}
+        # 内存映射的单元格缓存文件，释放单元格图片后才能关闭
+        self._mappings = []
+
+    def get(self, path):
+        """
+        获取解码后的图片，第一次使用时解码
+
+        参数:
+            path: 图片文件路径
+
+        返回:
+            PIL.Image对象，使用者不应修改或关闭它
+        """
+        image = self._images.get(path)
+        if image is None:
+            with Image.open(path) as source:
+                if self.draft_size:
+                    source.draft("RGB", self.draft_size)
+                source.load()
+                image = source.copy()
+            logger.debug(f"已解码 {path}，尺寸 {image.size}")
+            self._images[path] = image
+        return image
+
+    def get_cell(self, path, geometry, build):
+        """
+        获取处理好的单元格图片，优先从磁盘缓存内存映射
+
+        参数:
+            path: 海报文件路径
+            geometry: 决定单元格结果的全部参数，作为缓存键的一部分
+            build: 缓存未命中时调用 build(poster) 生成RGBA单元格
+
+        返回:
+            PIL.Image对象，使用者不应修改或关闭它
+        """
+        digest = file_digest(path) if config.CACHE_CONFIG["CELL_CACHE"] else None
+        if digest is None:
+            return build(self.get(path))
+
+        # 解码尺寸会影响缩放结果，也作为键的一部分
+        key = cell_cache.cell_key(digest, (geometry, self.draft_size))
+        cell = self._cells.get(key)
+        if cell is not None:
+            return cell
+
+        loaded = cell_cache.load(key)
+        if loaded is not None:
+            mapped, size = loaded
+            view = cell_cache.pixels(mapped)
+            self._mappings.append((mapped, view))
+            cell = Image.frombuffer("RGBA", size, view, "raw", "RGBA", 0, 1)
+            logger.debug(f"单元格缓存命中 {path}，尺寸 {size}")
+        else:
+            cell = build(self.get(path))
+            cell_cache.store(key, cell)
+        self._cells[key] = cell
+        return cell
+
+    def close(self):
+        """释放所有图片和内存映射"""
+        for image in self._images.values():
+            image.close()
+        self._images.clear()
+        for cell in self._cells.values():
+            cell.close()
+        self._cells.clear()
+        for mapped, view in self._mappings:
+            try:
+                view.release()
+                mapped.close()
+            except BufferError:
+                # 仍有图片引用映射内容，由垃圾回收关闭
+                logger.debug("单元格缓存映射仍在使用，稍后释放")
+        self._mappings.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
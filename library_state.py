@@ -0,0 +1,95 @@
+"""
+媒体库状态模块
+为每个媒体库保存上一次成功处理时的指纹（选中的媒体项、图片标签和相关配置），
+指纹不变说明海报不需要重新生成和上传
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+import config
+from logger import get_module_logger
+
+# 获取模块日志记录器
+logger = get_module_logger("library_state")
+
+STATE_PATH = os.path.join(config.CACHE_FOLDER, "library_state.json")
+
+_state_lock = threading.Lock()
+
+
+def get_state_key(server, library_id):
+    """媒体库在状态文件中的键，同一媒体库在不同服务器（或同一服务器的不同用户）上互不影响"""
+    return f"{server['BASE_URL'].rstrip('/')}|{server['USER_NAME']}|{library_id}"
+
+
+def compute_fingerprint(server, selected_items, library_name):
+    """
+    计算媒体库指纹
+
+    参数:
+        server: 服务器上下文
+        selected_items: 选中用于生成海报的媒体项列表（有序）
+        library_name: 媒体库名称
+
+    返回:
+        str: 指纹字符串
+    """
+    image_type = server["IMAGE_TYPE"]
+    template = next(
+        (t for t in config.TEMPLATE_MAPPING if t.get("library_name") == library_name),
+        None,
+    )
+    payload = {
+        "items": [
+            [item.get("Id"), item.get("ImageTags", {}).get(image_type)]
+            for item in selected_items
+        ],
+        "template": template,
+        "style": config.STYLE_CONFIGS,
+        "poster_gen": config.POSTER_GEN_CONFIG,
+        "animation": config.ANIMATION_CONFIG,
+        "static": config.STATIC_CONFIG,
+        "download": config.DOWNLOAD_CONFIG,
+        # 开启上传后需要重新处理一次，把海报传到服务器
+        "update_poster": server["UPDATE_POSTER"],
+    }
+    data = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def _load_state():
+    """读取状态文件，文件不存在或损坏时返回空字典"""
+    if not os.path.exists(STATE_PATH):
+        return {}
+    try:
+        with open(STATE_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        logger.warning(f"读取媒体库状态文件失败，将重新处理所有媒体库: {e}")
+        return {}
+
+
+def is_unchanged(server, library_id, fingerprint):
+    """判断媒体库指纹是否与上一次成功处理时相同"""
+    if not fingerprint:
+        return False
+    with _state_lock:
+        return _load_state().get(get_state_key(server, library_id)) == fingerprint
+
+
+def save_fingerprint(server, library_id, fingerprint):
+    """媒体库处理成功后保存指纹"""
+    if not fingerprint:
+        return
+    with _state_lock:
+        state = _load_state()
+        state[get_state_key(server, library_id)] = fingerprint
+        os.makedirs(os.path.dirname(STATE_PATH), exist_ok=True)
+        # 先写临时文件再替换，避免写入中断导致状态文件损坏
+        temp_path = f"{STATE_PATH}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, STATE_PATH)
@@ -3,6 +3,7 @@ import sys
 import time
 from datetime import datetime, timedelta
 import json
+from concurrent.futures import ThreadPoolExecutor
 
 # 强制标准输出不缓冲
 sys.stdout.reconfigure(line_buffering=True)
@@ -12,91 +13,202 @@ from croniter import croniter
 
 # 导入自定义模块
 import config
-from gen_poster import gen_poster_workflow
-from gen_animated_poster import gen_animated_poster_workflow
 from get_library import get_libraries
 from get_poster import download_posters_workflow
 from update_poster import upload_poster_workflow
+from http_session import close_all_sessions
+from artwork_cache import prune_cache
+import cell_cache
+import render_cache
+import library_state
+from pipeline import Pipeline, PipelineStats, Stage
+from render_pool import RenderExecutor
 from logger import app_logger as logger
 
 
-def process_libraries():
-    for jellyfin_config in config.JELLYFIN_CONFIGS:
-        config.JELLYFIN_CONFIG.update(jellyfin_config)
-        """
-        处理所有媒体库的核心逻辑
-        """
-        logger.info("=" * 50)
+def _upload_library(server, library, fingerprint):
+    """
+    上传生成好的媒体库海报，成功后记录指纹
+
+    参数:
+        server: 服务器上下文
+        library: 媒体库信息
+        fingerprint: 媒体库指纹
+    """
+    current_library = library["Name"]
+    uploaded = True
+    if server["UPDATE_POSTER"]:  # 检查是否需要更新海报
+        if current_library not in config.EXCLUDE_LIBRARY:
+            logger.info(
+                f"[{server['SERVER_NAME']}][{current_library}] [4/4] 上传海报..."
+            )
+            logger.info("-" * 40)
+            # 根据配置选择上传的文件格式
+            use_gif = config.ANIMATION_CONFIG["ENABLED"]
+            uploaded = upload_poster_workflow(
+                server, library["Id"], current_library, use_gif=use_gif
+            )
+        else:
+            logger.info(
+                f"[{server['SERVER_NAME']}][{current_library}] [4/4] 不更新海报（在排除列表中）..."
+            )
+            logger.info("-" * 40)
+            logger.info(
+                f"[{server['SERVER_NAME']}][{current_library}] 媒体库在排除列表中，已跳过上传海报"
+            )
+    else:
         logger.info(
-            f"开始执行服务器 [{jellyfin_config['SERVER_NAME']}] - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
+            f"[{server['SERVER_NAME']}][{current_library}] [4/4] 不更新海报（全局设置关闭）..."
+        )
+        logger.info("-" * 40)
+        logger.info(
+            f"[{server['SERVER_NAME']}][{current_library}] 全局海报更新设置已关闭，已跳过上传海报"
         )
-        logger.info("=" * 50)
 
-        # 1. 获取媒体库列表
-        libraries = get_libraries()
-        if not libraries:
-            logger.warning(
-                f"[{jellyfin_config['SERVER_NAME']}] 未能获取媒体库列表，任务终止"
-            )
-            return
+    # 生成和上传都成功后才记录指纹，失败的媒体库下次会重新处理
+    if uploaded:
+        library_state.save_fingerprint(server, library["Id"], fingerprint)
 
+
+def process_server(server_config, render_executor, pipeline_stats=None):
+    """
+    处理单个服务器的所有媒体库
+
+    参数:
+        server_config: JELLYFIN_CONFIGS 中的服务器配置
+        render_executor: 生成海报使用的 RenderExecutor
+        pipeline_stats: 记录各阶段时间的 PipelineStats，多个服务器共用
+    """
+    # 每次执行都创建新的上下文，认证信息不会在服务器之间或多次执行之间共享
+    server = config.create_server_context(server_config)
+
+    logger.info("=" * 50)
+    logger.info(
+        f"开始执行服务器 [{server['SERVER_NAME']}] - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
+    )
+    logger.info("=" * 50)
+
+    # 1. 获取媒体库列表
+    libraries = get_libraries(server)
+    if not libraries:
+        logger.warning(
+            f"[{server['SERVER_NAME']}] 未能获取媒体库列表，任务终止"
+        )
+        return
+
+    logger.info(
+        f"[{server['SERVER_NAME']}] 成功获取到 {len(libraries)} 个媒体库:"
+    )
+    for i, library in enumerate(libraries, 1):
+        logger.info(f"  {i}. {library['Name']} (ID: {library['Id']})")
+
+    def download(library):
+        """下载阶段：下载海报，媒体库没有变化时到此为止"""
+        current_library = library["Name"]
         logger.info(
-            f"[{jellyfin_config['SERVER_NAME']}] 成功获取到 {len(libraries)} 个媒体库:"
+            f"[{server['SERVER_NAME']}] 开始处理媒体库: {current_library} (ID: {library['Id']})"
+        )
+        # 2. 下载海报
+        success, count, fingerprint = download_posters_workflow(
+            server, library["Id"], current_library
         )
-        for i, library in enumerate(libraries, 1):
-            logger.info(f"  {i}. {library['Name']} (ID: {library['Id']})")
+        if not success:
+            logger.warning(
+                f"[{server['SERVER_NAME']}][{current_library}] 下载海报失败"
+            )
+            return None
 
-        # 这里可以根据需要选择特定的媒体库
-        for library in libraries:
-            current_library = library["Name"]
+        # 媒体项、图片和配置都没有变化时，跳过生成和上传
+        if config.SKIP_UNCHANGED_LIBRARY and library_state.is_unchanged(
+            server, library["Id"], fingerprint
+        ):
             logger.info(
-                f"[{jellyfin_config['SERVER_NAME']}] 开始处理媒体库: {current_library} (ID: {library['Id']})"
+                f"[{server['SERVER_NAME']}][{current_library}] 媒体项、海报图片和配置与上次成功处理时相同（指纹 {fingerprint[:12]}），跳过生成和上传"
             )
-            # 2. 下载海报
-            success, count = download_posters_workflow(library["Id"], current_library)
-            if not success:
-                logger.warning(
-                    f"[{jellyfin_config['SERVER_NAME']}][{current_library}] 下载海报失败"
-                )
-                continue
+            return None
+        return library, fingerprint
 
-            # 3. 生成海报（根据配置选择静态或动态）
-            if config.ANIMATION_CONFIG["ENABLED"]:
-                # 生成动态GIF海报
-                gen_animated_poster_workflow(current_library)
-            else:
-                # 生成静态PNG海报
-                gen_poster_workflow(current_library)
+    def render(job):
+        """生成阶段：根据配置生成静态或动态海报"""
+        library, fingerprint = job
+        # 3. 生成海报
+        future = render_executor.submit(
+            server, library["Name"], config.ANIMATION_CONFIG["ENABLED"]
+        )
+        if not render_executor.result(future, server, library["Name"]):
+            return None
+        return job
 
-            # 4. 上传海报到Jellyfin
-            if config.JELLYFIN_CONFIG["UPDATE_POSTER"]:  # 检查是否需要更新海报
-                if current_library not in config.EXCLUDE_LIBRARY:
-                    logger.info(
-                        f"[{jellyfin_config['SERVER_NAME']}][{current_library}] [4/4] 上传海报..."
-                    )
-                    logger.info("-" * 40)
-                    # 根据配置选择上传的文件格式
-                    use_gif = config.ANIMATION_CONFIG["ENABLED"]
-                    upload_poster_workflow(library["Id"], current_library, use_gif=use_gif)
-                else:
-                    logger.info(
-                        f"[{jellyfin_config['SERVER_NAME']}][{current_library}] [4/4] 不更新海报（在排除列表中）..."
-                    )
-                    logger.info("-" * 40)
-                    logger.info(
-                        f"[{jellyfin_config['SERVER_NAME']}][{current_library}] 媒体库在排除列表中，已跳过上传海报"
-                    )
-            else:
-                logger.info(
-                    f"[{jellyfin_config['SERVER_NAME']}][{current_library}] [4/4] 不更新海报（全局设置关闭）..."
-                )
-                logger.info("-" * 40)
-                logger.info(
-                    f"[{jellyfin_config['SERVER_NAME']}][{current_library}] 全局海报更新设置已关闭，已跳过上传海报"
-                )
+    def upload(job):
+        """上传阶段：按媒体库顺序上传"""
+        # 4. 上传海报到Jellyfin
+        _upload_library(server, *job)
+
+    # 下载、生成和上传分阶段同时进行：上传一个媒体库的同时生成下一个、下载再下一个
+    Pipeline(
+        [
+            Stage("下载", download),
+            Stage("生成", render, workers=render_executor.workers),
+            Stage("上传", upload, ordered=True),
+        ],
+        queue_size=config.PIPELINE_CONFIG["QUEUE_SIZE"],
+        stats=pipeline_stats,
+    ).run(libraries)
+
+    logger.info(f"[{server['SERVER_NAME']}] 所有媒体库任务已完成")
+    logger.info("=" * 50)
+
+
+def process_server_safely(server_config, render_executor, pipeline_stats=None):
+    """处理单个服务器，捕获异常避免影响其他服务器"""
+    try:
+        process_server(server_config, render_executor, pipeline_stats)
+    except Exception as e:
+        logger.error(
+            f"[{server_config['SERVER_NAME']}] 处理服务器时出错: {e}", exc_info=True
+        )
+
+
+def process_libraries():
+    """
+    处理所有服务器的媒体库，parallel_servers 大于1时多个服务器同时处理，
+    所有服务器的媒体库共用一个海报生成进程池
+    """
+    servers = config.JELLYFIN_CONFIGS
+    workers = max(1, min(config.PARALLEL_SERVERS, len(servers)))
+    pipeline_stats = PipelineStats()
+
+    with RenderExecutor(
+        config.RENDER_POOL_CONFIG["WORKERS"],
+        config.RENDER_POOL_CONFIG["MAX_TASKS_PER_CHILD"],
+        config.RENDER_POOL_CONFIG["TIMEOUT"],
+    ) as render_executor:
+        if workers == 1:
+            for server_config in servers:
+                process_server_safely(server_config, render_executor, pipeline_stats)
+        else:
+            logger.info(f"并行处理 {len(servers)} 个服务器，同时处理数量: {workers}")
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(
+                    lambda server_config: process_server_safely(
+                        server_config, render_executor, pipeline_stats
+                    ),
+                    servers,
+                ))
+
+    # 各阶段的利用率，用于调整进程数和队列容量
+    pipeline_stats.log_summary()
+
+    # 本轮任务结束，释放所有空闲连接，避免长时间占用服务器连接
+    close_all_sessions()
+    if config.ASYNC_NETWORK:
+        import async_client
+        async_client.close_all_clients()
 
-        logger.info(f"[{jellyfin_config['SERVER_NAME']}] 所有媒体库任务已完成")
-        logger.info("=" * 50)
+    # 清理长时间未使用的海报缓存、渲染缓存和单元格缓存
+    prune_cache()
+    render_cache.prune_cache()
+    cell_cache.prune_cache()
 
 
 def main():
@@ -0,0 +1,177 @@
+"""
+分阶段流水线
+每个阶段由若干线程处理，阶段之间使用有界队列连接，
+下游处理不过来时上游会等待，不会无限制地堆积任务。
+每个阶段记录忙碌、等待输入和等待下游的时间，用于判断哪个阶段是瓶颈
+"""
+
+import queue
+import threading
+import time
+
+from logger import get_module_logger
+
+# 获取模块日志记录器
+logger = get_module_logger("pipeline")
+
+# 队列结束标记
+_DONE = object()
+
+
+class Stage:
+    """
+    流水线的一个阶段
+
+    func(item) 返回交给下一阶段的结果，返回 None 表示该项到此为止。
+    ordered 为 True 时按输入顺序处理，只能使用一个线程
+    """
+
+    def __init__(self, name, func, workers=1, ordered=False):
+        self.name = name
+        self.func = func
+        self.workers = 1 if ordered else max(1, workers)
+        self.ordered = ordered
+
+
+class PipelineStats:
+    """
+    各阶段的时间统计，可以由多条流水线（例如多个服务器）共用，线程安全
+
+    busy: 处理任务的时间; starved: 等待上游输入的时间;
+    blocked: 等待下游队列空位的时间; alive: 所有线程的运行时间之和
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+
+    def add(self, name, items=0, busy=0.0, starved=0.0, blocked=0.0, alive=0.0):
+        with self._lock:
+            stage = self._stages.setdefault(
+                name, {"items": 0, "busy": 0.0, "starved": 0.0, "blocked": 0.0, "alive": 0.0}
+            )
+            stage["items"] += items
+            stage["busy"] += busy
+            stage["starved"] += starved
+            stage["blocked"] += blocked
+            stage["alive"] += alive
+
+    def log_summary(self):
+        """输出各阶段的利用率"""
+        with self._lock:
+            stages = dict(self._stages)
+        for name, stage in stages.items():
+            utilization = stage["busy"] / stage["alive"] * 100 if stage["alive"] else 0
+            logger.info(
+                f"阶段 [{name}] 处理 {stage['items']} 项，忙碌 {stage['busy']:.1f} 秒，"
+                f"利用率 {utilization:.0f}%，等待输入 {stage['starved']:.1f} 秒，"
+                f"等待下游 {stage['blocked']:.1f} 秒"
+            )
+
+
+class Pipeline:
+    """
+    按阶段处理一组输入，输入按顺序进入第一个阶段
+    """
+
+    def __init__(self, stages, queue_size=2, stats=None):
+        """
+        参数:
+            stages: Stage 列表，按处理顺序排列
+            queue_size: 阶段之间队列的容量
+            stats: 记录时间的 PipelineStats，为 None 时不记录
+        """
+        self.stages = stages
+        self.queue_size = max(1, queue_size)
+        self.stats = stats if stats is not None else PipelineStats()
+
+    def run(self, items):
+        """处理所有输入，所有阶段完成后返回"""
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        threads = []
+        for index, stage in enumerate(self.stages):
+            output = queues[index + 1] if index + 1 < len(self.stages) else None
+            # 最后一个线程退出时通知下游
+            remaining = [stage.workers]
+            lock = threading.Lock()
+            for worker_index in range(stage.workers):
+                thread = threading.Thread(
+                    target=self._run_stage,
+                    args=(stage, queues[index], output, remaining, lock),
+                    name=f"pipeline-{stage.name}-{worker_index}",
+                    daemon=True,
+                )
+                thread.start()
+                threads.append(thread)
+
+        # 输入带有序号，ordered 阶段按序号恢复顺序
+        for sequence, item in enumerate(items):
+            queues[0].put((sequence, item))
+        for _ in range(self.stages[0].workers):
+            queues[0].put(_DONE)
+
+        for thread in threads:
+            thread.join()
+
+    def _run_stage(self, stage, input_queue, output_queue, remaining, lock):
+        """阶段的工作线程"""
+        started = time.perf_counter()
+        items = 0
+        busy = starved = blocked = 0.0
+        # ordered 阶段暂存提前到达的项
+        waiting = {}
+        next_sequence = 0
+
+        def forward(sequence, result):
+            nonlocal blocked
+            if output_queue is None:
+                return
+            wait_start = time.perf_counter()
+            output_queue.put((sequence, result))
+            blocked += time.perf_counter() - wait_start
+
+        def process(sequence, item):
+            nonlocal busy, items
+            result = None
+            # 上游放弃的项只传递序号，保证下游的顺序不会卡住
+            if item is not None:
+                work_start = time.perf_counter()
+                try:
+                    result = stage.func(item)
+                except Exception as e:
+                    logger.error(f"流水线阶段 [{stage.name}] 处理出错: {e}", exc_info=True)
+                busy += time.perf_counter() - work_start
+                items += 1
+            forward(sequence, result)
+
+        while True:
+            wait_start = time.perf_counter()
+            entry = input_queue.get()
+            starved += time.perf_counter() - wait_start
+            if entry is _DONE:
+                break
+            if not stage.ordered:
+                process(*entry)
+                continue
+            waiting[entry[0]] = entry[1]
+            while next_sequence in waiting:
+                process(next_sequence, waiting.pop(next_sequence))
+                next_sequence += 1
+
+        with lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last and output_queue is not None:
+            # 下一阶段的每个线程都需要一个结束标记
+            next_stage = self.stages[self.stages.index(stage) + 1]
+            for _ in range(next_stage.workers):
+                output_queue.put(_DONE)
+
+        self.stats.add(
+            stage.name,
+            items=items,
+            busy=busy,
+            starved=starved,
+            blocked=blocked,
+            alive=time.perf_counter() - started,
+        )
@@ -0,0 +1,142 @@
+"""
+渲染结果缓存模块
+按全部渲染输入（海报图片内容、字体、模板映射、样式和生成配置）计算哈希，
+输入相同时直接复用上次生成的海报文件。
+渲染中的随机选择使用由哈希得到的种子，同样的输入总是生成同样的海报
+"""
+
+import hashlib
+import json
+import os
+import random
+import shutil
+import threading
+from functools import lru_cache
+
+import config
+from artwork_cache import prune_folder
+from logger import get_module_logger
+
+# 获取模块日志记录器
+logger = get_module_logger("render_cache")
+
+RENDER_CACHE_FOLDER = os.path.join(config.CACHE_FOLDER, "render")
+
+# 渲染效果有变化时递增，使旧版本生成的缓存失效
+RENDER_VERSION = 1
+
+
+@lru_cache(maxsize=256)
+def _file_digest(path, size, mtime_ns):
+    """计算文件内容的哈希，按路径、大小和修改时间缓存，字体等大文件只读取一次"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_digest(path):
+    """返回文件内容的哈希，文件不存在时返回 None"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return _file_digest(path, stat.st_size, stat.st_mtime_ns)
+
+
+def _font_files():
+    """渲染可能用到的字体文件：样式配置中的自定义字体和默认字体"""
+    fonts = {os.path.join("font", "ch.ttf"), os.path.join("font", "en.otf")}
+    for style in config.STYLE_CONFIGS:
+        for key in ("style_ch_font", "style_eng_font"):
+            if style.get(key):
+                fonts.add(os.path.join("myfont", style[key]))
+    return sorted(fonts)
+
+
+def compute_render_key(name, image_files, animated):
+    """
+    计算媒体库海报的渲染输入哈希
+
+    参数:
+        name: 媒体库名称
+        image_files: 渲染使用的图片文件，顺序与在海报中的位置对应
+        animated: 是否为动态海报
+
+    返回:
+        str: 十六进制哈希
+    """
+    output_config = config.ANIMATION_CONFIG if animated else config.STATIC_CONFIG
+    payload = {
+        "version": RENDER_VERSION,
+        "name": name,
+        "animated": animated,
+        "images": [file_digest(path) for path in image_files],
+        "fonts": {
+            path: file_digest(os.path.join(config.CURRENT_DIR, path)) for path in _font_files()
+        },
+        "template": next(
+            (t for t in config.TEMPLATE_MAPPING if t.get("library_name") == name), None
+        ),
+        "style": config.STYLE_CONFIGS,
+        "poster_gen": config.POSTER_GEN_CONFIG,
+        # 进程数只影响速度，不影响结果
+        "output": {key: value for key, value in output_config.items() if key != "RENDER_WORKERS"},
+    }
+    data = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def create_rng(render_key):
+    """由渲染输入哈希得到固定种子的随机数生成器"""
+    return random.Random(int(render_key[:16], 16))
+
+
+def _cache_path(render_key, output_path):
+    # 按前两位分子目录，扩展名与输出文件相同
+    extension = os.path.splitext(output_path)[1]
+    return os.path.join(RENDER_CACHE_FOLDER, render_key[:2], f"{render_key}{extension}")
+
+
+def restore(render_key, output_path):
+    """
+    缓存命中时把缓存的海报复制到输出路径
+
+    返回:
+        bool: 是否命中
+    """
+    if not config.CACHE_CONFIG["RENDER_CACHE"]:
+        return False
+    cache_path = _cache_path(render_key, output_path)
+    if not os.path.isfile(cache_path):
+        return False
+    # 刷新文件时间，避免被过期清理
+    os.utime(cache_path, None)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    shutil.copyfile(cache_path, output_path)
+    return True
+
+
+def store(render_key, output_path):
+    """把生成的海报保存到缓存，先写临时文件再改名，中途出错不会留下不完整的缓存"""
+    if not config.CACHE_CONFIG["RENDER_CACHE"]:
+        return
+    cache_path = _cache_path(render_key, output_path)
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    temp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        shutil.copyfile(output_path, temp_path)
+        os.replace(temp_path, cache_path)
+    except OSError as e:
+        logger.warning(f"保存渲染缓存失败: {cache_path}, {e}")
+
+
+def prune_cache(max_age_days=None):
+    """删除超过指定天数未使用的渲染缓存"""
+    if max_age_days is None:
+        max_age_days = config.CACHE_CONFIG["MAX_AGE_DAYS"]
+    removed = prune_folder(RENDER_CACHE_FOLDER, max_age_days)
+    if removed:
+        logger.info(f"已清理 {removed} 个超过 {max_age_days} 天未使用的渲染缓存")
+    return removed
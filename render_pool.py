@@ -0,0 +1,152 @@
+"""
+媒体库海报渲染进程池
+多个媒体库（包括不同服务器的媒体库）的海报生成分配到多个进程中同时进行，
+下载和上传仍在主进程中按媒体库顺序处理
+"""
+
+import math
+import signal
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import config
+from frame_pool import resolve_workers
+from logger import get_module_logger
+
+# 获取模块日志记录器
+logger = get_module_logger("render_pool")
+
+
+class RenderTimeout(BaseException):
+    """
+    单个媒体库的海报生成超时
+
+    继承 BaseException，不会被生成流程中捕获 Exception 的代码吞掉，finally 中的清理仍会执行
+    """
+
+
+def _snapshot_config():
+    """主进程的配置，工作进程使用同一份配置而不是重新读取配置文件"""
+    return {key: value for key, value in vars(config).items() if key.isupper()}
+
+
+def _init_worker(settings):
+    """工作进程初始化：应用主进程的配置"""
+    for key, value in settings.items():
+        setattr(config, key, value)
+
+
+def _on_timeout(signum, frame):
+    raise RenderTimeout()
+
+
+def render_library(server, name, animated, timeout=None):
+    """
+    生成一个媒体库的海报
+
+    参数:
+        server: 服务器上下文
+        name: 媒体库名称
+        animated: 是否生成动态海报
+        timeout: 超时时间（秒），只在支持 SIGALRM 的系统的主线程中生效
+
+    返回:
+        bool: 是否生成成功
+    """
+    # 延迟导入，主进程只在实际渲染时才加载渲染模块
+    from gen_animated_poster import gen_animated_poster_workflow
+    from gen_poster import gen_poster_workflow
+
+    workflow = gen_animated_poster_workflow if animated else gen_poster_workflow
+    if not timeout or not hasattr(signal, "SIGALRM"):
+        return workflow(server, name)
+
+    previous = signal.signal(signal.SIGALRM, _on_timeout)
+    signal.alarm(timeout)
+    try:
+        return workflow(server, name)
+    finally:
+        signal.alarm(0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+class RenderExecutor:
+    """
+    媒体库海报渲染执行器
+
+    workers 为1时在调用线程中直接生成，submit 返回时结果已经完成；
+    大于1时使用进程池，工作进程处理 max_tasks_per_child 个媒体库后重新创建，
+    避免内存不断增长。可以用作上下文管理器
+    """
+
+    def __init__(self, workers=1, max_tasks_per_child=None, timeout=None):
+        """
+        参数:
+            workers: 进程数，0或负数表示使用全部CPU核心
+            max_tasks_per_child: 每个工作进程处理多少个媒体库后重新创建，0或None表示不重新创建
+            timeout: 单个媒体库的生成超时时间（秒），0或None表示不限制
+        """
+        self.workers = resolve_workers(workers)
+        self.timeout = math.ceil(timeout) if timeout else None
+        self._executor = None
+        if self.workers > 1:
+            settings = _snapshot_config()
+            # 已经按媒体库并行，每个媒体库内部不再使用多个进程渲染动画帧
+            settings["ANIMATION_CONFIG"] = dict(settings["ANIMATION_CONFIG"], RENDER_WORKERS=1)
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                max_tasks_per_child=max_tasks_per_child or None,
+                initializer=_init_worker,
+                initargs=(settings,),
+            )
+            logger.info(
+                f"使用 {self.workers} 个进程生成海报，每个进程最多处理 {max_tasks_per_child or '不限'} 个媒体库"
+            )
+
+    def submit(self, server, name, animated):
+        """
+        提交一个媒体库的海报生成任务
+
+        返回:
+            Future，结果为是否生成成功
+        """
+        if self._executor is not None:
+            return self._executor.submit(render_library, server, name, animated, self.timeout)
+
+        # 单进程时直接生成，与逐个处理媒体库的行为相同
+        future = Future()
+        try:
+            future.set_result(render_library(server, name, animated))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def result(self, future, server, name):
+        """
+        等待生成结果，出错或超时时记录日志
+
+        返回:
+            bool: 是否生成成功
+        """
+        try:
+            return future.result()
+        except RenderTimeout:
+            logger.error(
+                f"[{server['SERVER_NAME']}][{name}] 生成海报超过 {self.timeout} 秒，已放弃"
+            )
+        except Exception as e:
+            logger.error(
+                f"[{server['SERVER_NAME']}][{name}] 生成海报时出错: {e}", exc_info=True
+            )
+        return False
+
+    def shutdown(self):
+        """关闭进程池，未开始的任务会被取消"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
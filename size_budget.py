@@ -0,0 +1,69 @@
+"""
+输出文件大小预算
+编码参数按从高质量（文件大）到低质量（文件小）排列，
+二分查找不超过预算的质量最高的参数，只有结果满足预算的那次编码会写入文件
+"""
+
+import io
+import os
+
+from logger import get_module_logger
+
+# 获取模块日志记录器
+logger = get_module_logger("size_budget")
+
+
+def _encode_to_bytes(encode, level):
+    """按给定参数编码到内存，返回编码结果"""
+    buffer = io.BytesIO()
+    encode(level, buffer)
+    return buffer.getvalue()
+
+
+def fit_to_budget(encode, levels, max_bytes, output_path):
+    """
+    选择不超过大小预算的编码参数并写入文件
+
+    参数:
+        encode: 编码函数，调用方式为 encode(level, fp)，把结果写入文件对象 fp
+        levels: 编码参数列表，从质量最高到质量最低排列
+        max_bytes: 文件大小上限（字节），0或None表示不限制，直接使用第一个参数
+        output_path: 输出文件路径
+
+    返回:
+        (使用的参数, 文件大小, 编码次数)，所有参数都超出预算时使用最后一个参数
+    """
+    if not max_bytes:
+        with open(output_path, "wb") as fp:
+            encode(levels[0], fp)
+        return levels[0], os.path.getsize(output_path), 1
+
+    attempts = 0
+
+    def attempt(index):
+        nonlocal attempts
+        attempts += 1
+        data = _encode_to_bytes(encode, levels[index])
+        logger.debug(f"编码参数 {levels[index]}: {len(data) / 1024:.1f} KB")
+        return data
+
+    # 大多数情况下默认参数就满足预算，只编码一次
+    best_index = 0
+    best = attempt(0)
+    if len(best) > max_bytes and len(levels) > 1:
+        best_index = len(levels) - 1
+        best = attempt(best_index)
+        if len(best) <= max_bytes:
+            # low 超出预算，high 满足预算，在两者之间查找
+            low, high = 0, best_index
+            while high - low > 1:
+                middle = (low + high) // 2
+                data = attempt(middle)
+                if len(data) <= max_bytes:
+                    high, best_index, best = middle, middle, data
+                else:
+                    low = middle
+
+    with open(output_path, "wb") as fp:
+        fp.write(best)
+    return levels[best_index], len(best), attempts
@@ -56,7 +56,7 @@ def create_test_poster(output_path, index, size=(410, 610)):
     print(f"创建测试海报: {output_path}")
 
 
-def setup_test_environment():
+def setup_test_environment(server):
     """设置测试环境，创建必要的文件夹和测试图片"""
     test_library_name = "TestLibrary"
     
@@ -76,7 +76,7 @@ def setup_test_environment():
         print(f"添加测试库配置: {test_library_name}")
     
     # 创建poster文件夹
-    poster_folder = os.path.join(config.POSTER_FOLDER, test_library_name)
+    poster_folder = os.path.join(server["POSTER_DIR"], test_library_name)
     if not os.path.exists(poster_folder):
         os.makedirs(poster_folder)
         print(f"创建测试文件夹: {poster_folder}")
@@ -88,9 +88,9 @@ def setup_test_environment():
             create_test_poster(poster_path, i)
     
     # 创建output文件夹
-    if not os.path.exists(config.OUTPUT_FOLDER):
-        os.makedirs(config.OUTPUT_FOLDER)
-        print(f"创建输出文件夹: {config.OUTPUT_FOLDER}")
+    if not os.path.exists(server["OUTPUT_DIR"]):
+        os.makedirs(server["OUTPUT_DIR"])
+        print(f"创建输出文件夹: {server['OUTPUT_DIR']}")
     
     return test_library_name
 
@@ -101,15 +101,18 @@ def run_test():
     print("动态海报生成测试")
     print("=" * 50)
     
+    # 使用第一个服务器的上下文作为测试环境
+    server = config.create_server_context(config.JELLYFIN_CONFIGS[0])
+    
     # 设置测试环境
-    test_library = setup_test_environment()
+    test_library = setup_test_environment(server)
     
     # 运行动画生成
     print(f"\n正在生成动态海报: {test_library}")
-    result = gen_animated_poster_workflow(test_library)
+    result = gen_animated_poster_workflow(server, test_library)
     
     if result:
-        output_path = os.path.join(config.OUTPUT_FOLDER, f"{test_library}.gif")
+        output_path, _ = config.get_output_file(server, test_library, animated=True)
         file_size = os.path.getsize(output_path) / 1024 / 1024  # MB
         print(f"\n✓ 测试成功!")
         print(f"  输出文件: {output_path}")
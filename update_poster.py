@@ -4,6 +4,7 @@ import sys
 import base64
 from urllib.parse import urljoin
 import config
+from http_session import get_session
 from PIL import Image, ImageFilter, ImageEnhance
 from logger import get_module_logger
 
@@ -11,11 +12,6 @@ from logger import get_module_logger
 logger = get_module_logger("update_poster")
 
 
-def load_config():
-    """加载配置信息"""
-    return config.JELLYFIN_CONFIG
-
-
 def read_image_file(path):
     """读取图片文件并转换为base64编码"""
     try:
@@ -28,38 +24,49 @@ def read_image_file(path):
         raise IOError(f"错误: 读取图片文件时出错: {e}")
 
 
-def upload_image(item_id, image_data, library_name, content_type="image/jpeg"):
+def upload_image(server, item_id, image_data, library_name, content_type="image/jpeg"):
     """上传图片到Jellyfin服务器"""
+    if config.ASYNC_NETWORK:
+        # 异步网络模式：请求在共享的事件循环中执行
+        import async_client
+        return async_client.run(
+            async_client.get_client(server).upload_image(
+                server, item_id, image_data, library_name, content_type
+            )
+        )
+
     try:
         # 构造 URL 和请求头
-        url = f"{config.JELLYFIN_CONFIG['BASE_URL']}/Items/{item_id}/Images/{config.JELLYFIN_CONFIG['IMAGE_TYPE']}"
+        url = f"{server['BASE_URL']}/Items/{item_id}/Images/{server['IMAGE_TYPE']}"
         headers = {
-            "Authorization": f'MediaBrowser Token="{config.JELLYFIN_CONFIG["ACCESS_TOKEN"]}"',
+            "Authorization": f'MediaBrowser Token="{server["ACCESS_TOKEN"]}"',
             "Content-Type": content_type,
         }
-        response = requests.post(url, headers=headers, data=image_data, timeout=30)
+        response = get_session(server).post(
+            url, headers=headers, data=image_data, timeout=config.HTTP_CONFIG["TIMEOUT"]
+        )
 
         if response.status_code in (200, 204):
             logger.info(
-                f"[{config.JELLYFIN_CONFIG['SERVER_NAME']}][{library_name}] 成功: 图片上传成功"
+                f"[{server['SERVER_NAME']}][{library_name}] 成功: 图片上传成功"
             )
             return True
         else:
             logger.error(
-                f"[{config.JELLYFIN_CONFIG['SERVER_NAME']}][{library_name}] 错误: 图片上传失败，状态码: {response.status_code}"
+                f"[{server['SERVER_NAME']}][{library_name}] 错误: 图片上传失败，状态码: {response.status_code}"
             )
             try:
                 logger.error(
-                    f"[{config.JELLYFIN_CONFIG['SERVER_NAME']}][{library_name}] 错误详情: {response.json()}"
+                    f"[{server['SERVER_NAME']}][{library_name}] 错误详情: {response.json()}"
                 )
             except ValueError:
                 logger.error(
-                    f"[{config.JELLYFIN_CONFIG['SERVER_NAME']}][{library_name}] 错误详情: {response.text[:500]}"
+                    f"[{server['SERVER_NAME']}][{library_name}] 错误详情: {response.text[:500]}"
                 )
             return False
     except requests.exceptions.RequestException as e:
         logger.error(
-            f"[{config.JELLYFIN_CONFIG['SERVER_NAME']}][{library_name}] 错误: 请求过程中出错: {e}"
+            f"[{server['SERVER_NAME']}][{library_name}] 错误: 请求过程中出错: {e}"
         )
         return False
 
@@ -104,66 +111,57 @@ def add_shadow(img, offset=(5, 5), shadow_color=(0, 0, 0, 100), blur_radius=3):
     return shadow_img
 
 
-def upload_poster_workflow(item_id, name, use_gif=False):
+def upload_poster_workflow(server, item_id, name, use_gif=False):
     """
     封装上传海报到Jellyfin的完整工作流程
 
     参数:
+        server: 服务器上下文
         item_id: Jellyfin媒体库ID
         name: 媒体库名称
-        use_gif: 是否上传动画格式（GIF或WebP）
+        use_gif: 是否上传动态海报
 
     返回:
         bool: 上传是否成功
     """
     try:
         logger.info(
-            f"[{config.JELLYFIN_CONFIG['SERVER_NAME']}][{name}] [4/4] 正在更新Jellyfin海报..."
+            f"[{server['SERVER_NAME']}][{name}] [4/4] 正在更新Jellyfin海报..."
         )
         logger.info("-" * 40)
 
-        # 根据格式选择文件路径和Content-Type
-        if use_gif:
-            # 根据动画配置选择格式
-            output_format = config.ANIMATION_CONFIG.get("OUTPUT_FORMAT", "GIF").upper()
-            if output_format == "WEBP":
-                file_path = os.path.join(config.OUTPUT_FOLDER, f"{name}.webp")
-                content_type = "image/webp"
-                logger.info(f"[{config.JELLYFIN_CONFIG['SERVER_NAME']}][{name}] 上传动态WebP海报")
-            else:
-                file_path = os.path.join(config.OUTPUT_FOLDER, f"{name}.gif")
-                content_type = "image/gif"
-                logger.info(f"[{config.JELLYFIN_CONFIG['SERVER_NAME']}][{name}] 上传动态GIF海报")
-        else:
-            file_path = os.path.join(config.OUTPUT_FOLDER, f"{name}.png")
-            content_type = "image/png"
-            logger.info(f"[{config.JELLYFIN_CONFIG['SERVER_NAME']}][{name}] 上传静态PNG海报")
-        
+        # 文件路径和Content-Type跟随配置的输出格式
+        file_path, content_type = config.get_output_file(server, name, animated=use_gif)
+        logger.info(
+            f"[{server['SERVER_NAME']}][{name}] 上传{'动态' if use_gif else '静态'}"
+            f"{config.get_output_format(animated=use_gif)}海报"
+        )
+
         # 检查文件是否存在
         if not os.path.exists(file_path):
-            logger.error(f"[{config.JELLYFIN_CONFIG['SERVER_NAME']}][{name}] 海报文件不存在: {file_path}")
+            logger.error(f"[{server['SERVER_NAME']}][{name}] 海报文件不存在: {file_path}")
             return False
         
         # 读取图片文件
         image_data_base64 = read_image_file(file_path)
 
         # 上传图片
-        success = upload_image(item_id, image_data_base64, name, content_type)
+        success = upload_image(server, item_id, image_data_base64, name, content_type)
 
         if success:
             logger.info(
-                f"[{config.JELLYFIN_CONFIG['SERVER_NAME']}][{name}] 海报上传成功！"
+                f"[{server['SERVER_NAME']}][{name}] 海报上传成功！"
             )
             return True
         else:
             logger.warning(
-                f"[{config.JELLYFIN_CONFIG['SERVER_NAME']}][{name}] 海报上传失败！"
+                f"[{server['SERVER_NAME']}][{name}] 海报上传失败！"
             )
             return False
 
     except Exception as e:
         logger.error(
-            f"[{config.JELLYFIN_CONFIG['SERVER_NAME']}][{name}] 上传海报时出错: {e}",
+            f"[{server['SERVER_NAME']}][{name}] 上传海报时出错: {e}",
             exc_info=True,
         )
         return False